@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+import argparse
+import collections
+import random
+import time
+import timeit
+import tracemalloc
+
+from stm_layout import chip_db, chip_stm, gpio_regs, solver
+from stm_layout.tk import tk_bga, tk_edgy, tk_elems, tk_spatial, tk_tssop
+
+
+def _decode_per_pin(moder, otyper, ospeedr, pupdr, afr):
+    return [((moder >> (2*n)) & 0x3,
+             (otyper >> n) & 0x1,
+             (ospeedr >> (2*n)) & 0x3,
+             (pupdr >> (2*n)) & 0x3,
+             (afr >> (4*n)) & 0xF,
+             )
+            for n in range(16)]
+
+
+def _encode_per_pin(pins):
+    moder, otyper, ospeedr, pupdr, afr = 0, 0, 0, 0, 0
+    for n, (m, t, s, p, a) in enumerate(pins):
+        moder   |= (m << 2*n)
+        otyper  |= (t << 1*n)
+        ospeedr |= (s << 2*n)
+        pupdr   |= (p << 2*n)
+        afr     |= (a << 4*n)
+    return moder, otyper, ospeedr, pupdr, afr
+
+
+class _ShiftPortState:
+    # A PortState that updates its words with shifts and masks on every
+    # set_pin(), for comparison with the lanes that chip_stm.PortState
+    # encodes in one go.
+    def __init__(self):
+        self.words = [0, 0, 0, 0, 0]
+
+    def set_pin(self, n, mode, otype, speed, pull, af):
+        w    = self.words
+        m1   = ~(0x1 << n)
+        m2   = ~(0x3 << 2*n)
+        w[0] = (w[0] & m2) | (mode << 2*n)
+        w[1] = (w[1] & m1) | (otype << n)
+        w[2] = (w[2] & m2) | (speed << 2*n)
+        w[3] = (w[3] & m2) | (pull << 2*n)
+        w[4] = (w[4] & ~(0xF << 4*n)) | (af << 4*n)
+
+
+def _configure_shift(pins):
+    state = _ShiftPortState()
+    for n, fields in enumerate(pins):
+        state.set_pin(n, *fields)
+    return state.words
+
+
+def _configure_lanes(pins):
+    state = chip_stm.PortState('PA')
+    for n, fields in enumerate(pins):
+        state.set_pin(n, True, *fields)
+    return state.words()
+
+
+def bench_codec(number):
+    # One "port" worth of random register words, decoded and re-encoded both
+    # with the per-pin shift/mask loops and with the gpio_regs codec, and
+    # every pin of a port configured and the words read back, by a shadow
+    # updating its words per pin and by chip_stm.PortState.  Each is the best
+    # of five runs.
+    rng   = random.Random(0)
+    words = [rng.getrandbits(32) for _ in range(6)]
+    words[1] &= 0xFFFF
+    afr   = words[4] | (words[5] << 32)
+    pins  = _decode_per_pin(words[0], words[1], words[2], words[3], afr)
+    lanes = gpio_regs.decode_port(*words)
+
+    results = [
+        ('decode per-pin', lambda: _decode_per_pin(words[0], words[1],
+                                                   words[2], words[3], afr)),
+        ('decode codec', lambda: gpio_regs.decode_port(*words)),
+        ('encode per-pin', lambda: _encode_per_pin(pins)),
+        ('encode codec', lambda: gpio_regs.encode_port(*lanes)),
+        ('port per-pin', lambda: _configure_shift(pins)),
+        ('port lanes', lambda: _configure_lanes(pins)),
+        ]
+    for name, fn in results:
+        t = min(timeit.repeat(fn, number=number, repeat=5))
+        print('%-16s %8.3f us/port' % (name, t * 1e6 / number))
+
+
+def bench_summary(_number, prefix='stm32g4'):
+    # chip_db.summary() for every part in a family: first built from the
+    # device index, then answered from SUMMARIES, against loading each part's
+    # gpio driver, which is what the index saves.
+    devices = [chip_db.get_device(p) for p in chip_db.find(prefix)]
+    chip_db.SUMMARIES.clear()
+    avoided = chip_db.DRIVER_LOADS_AVOIDED
+
+    results = []
+    for name, fn in (('summary indexed', chip_db.summary),
+                     ('summary cached', chip_db.summary),
+                     ('gpio driver', lambda d: d.get_driver('gpio'))):
+        t0 = time.perf_counter()
+        for d in devices:
+            fn(d)
+        results.append((name, time.perf_counter() - t0))
+    for name, t in results:
+        print('%-16s %8.3f ms for %u parts' % (name, t * 1e3, len(devices)))
+    print('%u of %u summaries avoided a gpio driver load' % (
+        chip_db.DRIVER_LOADS_AVOIDED - avoided, 2*len(devices)))
+
+
+def bench_memory(_number, prefix='stm32g4'):
+    # Memory retained by the Chip objects of every part in a family.  The
+    # devices are parsed and their gpio drivers loaded before tracing starts
+    # so that only the pin model is measured.
+    devices = [chip_db.get_device(p) for p in chip_db.find(prefix)]
+    devices = [d for d in devices
+               if chip_db.summary(d).package_cls is not None]
+    for d in devices:
+        d.get_driver('gpio')
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    chips  = []
+    for d in devices:
+        try:
+            chips.append(chip_stm.make_chip(d))
+        except (IndexError, KeyError):
+            # Package geometry doesn't fit the pin keys; not our concern here.
+            pass
+    after  = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    total = sum(s.size_diff for s in after.compare_to(before, 'filename'))
+    npins = sum(len(c.pins) for c in chips)
+    print('%u chips, %u pins: %.1f KiB total, %.0f bytes/pin' % (
+        len(chips), npins, total / 1024., total / max(npins, 1)))
+
+
+SOLVER_REQUESTS = ['USART1', '2*USART', 'UART', 'SPI2', '2*SPI', 'I2C1',
+                   'I2C', 'FDCAN', 'QUADSPI', 'SDMMC1',
+                   'TIM1:CH1,CH2,CH3,CH1N,CH2N,CH3N', 'TIM3:CH1,CH2,CH3,CH4']
+
+
+def bench_solver(_number, prefix='stm32h7', budget=10.):
+    # Solves a fixed wish list on every part of the family with the largest
+    # pin count, first for any assignment and then for the one that keeps
+    # signals closest to the left edge.
+    parts = chip_db.find(prefix)
+    npins = max(p.pin_count for p in parts)
+    for p in parts:
+        if p.pin_count != npins:
+            continue
+        try:
+            chip = chip_stm.load_chip(p.partname)
+        except (IndexError, KeyError):
+            continue
+        for name, score in (('any', None),
+                            ('left', solver.side_score(chip, 'left'))):
+            t0 = time.perf_counter()
+            try:
+                sol    = solver.solve(chip, SOLVER_REQUESTS, score=score,
+                                      budget=budget)
+                result = ('no solution' if sol is None else
+                          '%u signals, cost %.2f%s' % (
+                              len(sol.assignment), sol.cost,
+                              '' if sol.optimal else ' (timeout)'))
+            except solver.Timeout:
+                result = 'timeout'
+            except ValueError as e:
+                result = str(e)
+            print('%-20s %-5s %8.1f ms  %s' % (
+                p.partname, name, (time.perf_counter() - t0) * 1e3, result))
+
+
+# Stands in for a CanvasElem, so that hover lookups can be timed without a
+# display.
+HoverElem = collections.namedtuple('HoverElem', ['x', 'y', 'width', 'height'])
+
+
+def _bga_layout(dim, hole):
+    # A dim x dim ball grid, spaced like BGAWorkspace, with a hole x hole
+    # unpopulated centre.
+    lo    = (dim - hole) // 2
+    elems = [HoverElem(tk_bga.PIN_SPACE + x*tk_bga.PIN_DELTA,
+                       tk_bga.PIN_SPACE + y*tk_bga.PIN_DELTA,
+                       tk_bga.PIN_DIAM, tk_bga.PIN_DIAM)
+             for x in range(dim) for y in range(dim)
+             if not (lo <= x < lo + hole and lo <= y < lo + hole)]
+    size  = dim*tk_bga.PIN_DELTA + tk_bga.PIN_SPACE
+    return elems, size, size
+
+
+def _edge_layout(w, h, cw, ch, pad=100):
+    # Pins on the edges of a w x h body, placed like tk_edgy.Workspace: ch
+    # per side edge and cw per top and bottom edge.
+    pl    = tk_edgy.PIN_LENGTH
+    pw    = tk_edgy.PIN_WIDTH
+    elems = []
+    for i in range(ch):
+        elems.append(HoverElem(pad - pl, tk_edgy.pin_d(pad, pad + h, i),
+                               pl, pw))
+        elems.append(HoverElem(pad + w, tk_edgy.pin_d(pad + h, pad, i),
+                               pl, pw))
+    for i in range(cw):
+        elems.append(HoverElem(tk_edgy.pin_d(pad, pad + w, i), pad + h,
+                               pw, pl))
+        elems.append(HoverElem(tk_edgy.pin_d(pad + w, pad, i), pad - pl,
+                               pw, pl))
+    return elems, w + 2*pad, h + 2*pad
+
+
+def _scan_nearest(elems, x, y):
+    # The linear scan Workspace.mouse_moved() used before the GridIndex.
+    closest  = elems[-1]
+    distance = tk_elems.CanvasElem.distance_squared(closest, x, y)
+    for e in reversed(elems):
+        d = tk_elems.CanvasElem.distance_squared(e, x, y)
+        if d < distance:
+            distance = d
+            closest  = e
+    return closest
+
+
+def bench_hover(number):
+    # Nearest-pin lookups at random points of the canvas, by linear scan and
+    # through the Tk workspaces' GridIndex, for synthetic layouts of the
+    # largest BGA, LQFP and TSSOP packages.
+    pw      = tk_edgy.PIN_WIDTH
+    layouts = [
+        ('TFBGA265', _bga_layout(17, 5)),
+        ('LQFP176', _edge_layout(2*pw*44 + pw, 2*pw*44 + pw, 44, 44)),
+        ('TSSOP20', _edge_layout(tk_tssop.PKG_WIDTH, 2*pw*10 + pw, 0, 10)),
+        ]
+    rng = random.Random(0)
+    for name, (elems, w, h) in layouts:
+        points = [(rng.uniform(0, w), rng.uniform(0, h))
+                  for _ in range(number)]
+        t0     = time.perf_counter()
+        index  = tk_spatial.GridIndex(elems, (0, 0, w, h))
+        build  = time.perf_counter() - t0
+
+        t0     = time.perf_counter()
+        scan   = [_scan_nearest(elems, x, y) for x, y in points]
+        t_scan = time.perf_counter() - t0
+        t0     = time.perf_counter()
+        grid   = [index.nearest(x, y) for x, y in points]
+        t_grid = time.perf_counter() - t0
+
+        bad = sum(a is not b for a, b in zip(scan, grid))
+        print('%-9s %3u pins: scan %7.1f us, index %5.1f us (built in '
+              '%.2f ms)%s' % (name, len(elems), t_scan * 1e6 / number,
+                              t_grid * 1e6 / number, build * 1e3,
+                              ', %u MISMATCHES' % bad if bad else ''))
+
+
+BENCHMARKS = {
+    'codec'   : bench_codec,
+    'hover'   : bench_hover,
+    'memory'  : bench_memory,
+    'solver'  : bench_solver,
+    'summary' : bench_summary,
+}
+
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--number', '-n', type=int, default=10000)
+    rv = parser.parse_args()
+
+    BENCHMARKS[rv.benchmark](rv.number)
+
+
+if __name__ == '__main__':
+    _main()
@@ -1,61 +1,292 @@
+import collections
+import concurrent.futures
 import glob
+import json
 import math
+import operator
+import os
 import re
+import tempfile
 
+import modm_devices
 import modm_devices.parser
 import modm_devices.pkg
 
 from . import chip_package
+from . import gpio_regs
+from . import part_index
 
 
-DEVICES = None
+# Bump whenever the layout of an index record changes.
+INDEX_VERSION = 3
+CACHE_DIR     = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                             os.path.join(os.path.expanduser('~'), '.cache'),
+                             'stm_layout')
+INDEX_FILE    = os.path.join(CACHE_DIR, 'device_index.json')
 
+DEVICES         = part_index.PartIndex()
+DEVICE_FILES    = {}
+LOADED_PREFIXES = set()
 
-def _populate_devices(prefix=None):
-    global DEVICES
-    DEVICES = {}
-    basedir = modm_devices.pkg.get_filename('modm_devices', 'resources/devices')
-    if prefix is None:
-        prefix = ""
-    for filename in glob.glob('{}/**/{}*.xml'.format(basedir, prefix)):
-        parser  = modm_devices.parser.DeviceParser()
-        devfile = parser.parse(filename)
-        for device in devfile.get_devices():
-            DEVICES[device.partname] = device
+# DRIVER_LOADS_AVOIDED counts the summary() calls answered without loading
+# the part's gpio driver; 'python3 -m stm_layout.bench summary' reports it.
+PackageSummary = collections.namedtuple(
+        'PackageSummary', ['name', 'pin_count', 'package_cls', 'dims'])
+SUMMARIES            = {}
+DRIVER_LOADS_AVOIDED = 0
 
 
-def find(name):
-    if DEVICES is None:
-        _populate_devices(name[:7])
+FILTER_RE   = re.compile(r'^\s*(\w+)\s*(>=|<=|!=|=|<|>)\s*(\S+)\s*$')
+FILTER_KEYS = {
+    'family'      : 'family',
+    'package'     : 'package',
+    'pkg'         : 'package',
+    'pins'        : 'pins',
+    'flash'       : 'flash',
+    'temperature' : 'temperature',
+    'temp'        : 'temperature',
+}
+FILTER_OPS  = {
+    '='  : operator.eq,
+    '!=' : operator.ne,
+    '<'  : operator.lt,
+    '<=' : operator.le,
+    '>'  : operator.gt,
+    '>=' : operator.ge,
+}
+SIZE_SUFFIXES = {'K' : 1024, 'M' : 1024*1024}
+
 
-    devs = []
-    for partname, dev in DEVICES.items():
-        if name in partname:
-            devs.append(dev)
+class Part:
+    def __init__(self, filename, partname, family, package_name, npins,
+                 flash, identifier):
+        self.partname   = partname
+        self.family     = family
+        self.package    = package_name
+        self.pin_count  = npins
+        self.flash      = flash
+        self.filename   = filename
+        self.identifier = identifier
 
-    return devs
+    def __str__(self):
+        return self.partname
 
 
-def pin_count(dev):
-    # Unfortunately, sometimes R means 64 and sometimes it means 68.  So, we
-    # just count the pins.  For some reason, counting the pins goes slower.
-    # Maybe modm-devices does some deferred loading? Yes it does. -Niklas
-    return len(set(p['position']
-                   for p in dev.get_driver('gpio')['package'][0]['pin']))
+def _modm_version():
+    return getattr(modm_devices, '__version__', 'unknown')
 
 
-def package(dev):
+def load_cache(path, version):
     try:
-        return dev.get_driver('gpio')['package'][0]['name']
-    except Exception:
+        with open(path, encoding='utf8') as f:
+            cache = json.load(f)
+        if (cache['version'] == version and
+                cache['modm-devices'] == _modm_version()):
+            return cache
+    except (OSError, ValueError, KeyError, TypeError):
         pass
-    raise Exception('Device %s has unknown package "%s".'
-                    % (dev, dev.identifier.package))
 
+    return {'version'       : version,
+            'modm-devices'  : _modm_version(),
+            'files'         : {},
+            }
 
-def make_package(dev):
-    p = package(dev)
-    n = pin_count(dev)
+
+def save_cache(path, cache):
+    # Caches can always be rebuilt, so failing to write one (read-only home
+    # directory, full disk, ...) just means the next run parses XML again.
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf8') as f:
+                json.dump(cache, f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError:
+        pass
+
+
+def _index_file(filename):
+    parser  = modm_devices.parser.DeviceParser()
+    devfile = parser.parse(filename)
+    records = []
+    for device in devfile.get_devices():
+        ident = device.identifier
+        try:
+            package_name = package(device)
+            npins        = pin_count(device)
+        except Exception:
+            package_name = None
+            npins        = 0
+        records.append([device.partname,
+                        ident.get('platform', '') + ident.get('family', ''),
+                        package_name,
+                        npins,
+                        flash_size(device),
+                        {k: ident[k] for k in ident.keys()},
+                        ])
+    return records
+
+
+def map_files(fn, filenames, jobs):
+    # Results come back in the order of filenames regardless of which worker
+    # finishes first, so merging them is deterministic.  fn must be a
+    # module-level function returning picklable data.
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    if jobs <= 1 or len(filenames) <= 1:
+        return [fn(f) for f in filenames]
+
+    jobs = min(jobs, len(filenames))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(fn, filenames))
+
+
+def refresh_cache(cache, prefix, fn, jobs):
+    # Runs fn over every device file matching prefix whose cache entry is
+    # missing or older than the file, and returns [(filename, data), ...] for
+    # all matching files plus whether anything had to be rebuilt.
+    basedir   = modm_devices.pkg.get_filename('modm_devices',
+                                              'resources/devices')
+    filenames = sorted(glob.glob('{}/**/{}*.xml'.format(basedir, prefix)))
+    stale     = []
+    for filename in filenames:
+        relpath = os.path.relpath(filename, basedir)
+        entry   = cache['files'].get(relpath)
+        if entry is None or entry['mtime'] != os.path.getmtime(filename):
+            stale.append(filename)
+
+    for filename, data in zip(stale, map_files(fn, stale, jobs)):
+        relpath = os.path.relpath(filename, basedir)
+        cache['files'][relpath] = {'mtime' : os.path.getmtime(filename),
+                                   'data'  : data,
+                                   }
+
+    return ([(f, cache['files'][os.path.relpath(f, basedir)]['data'])
+             for f in filenames],
+            bool(stale))
+
+
+def _populate_devices(prefix=None, jobs=1):
+    if prefix is None:
+        prefix = ""
+    index        = load_cache(INDEX_FILE, INDEX_VERSION)
+    files, dirty = refresh_cache(index, prefix, _index_file, jobs)
+
+    parts = []
+    for filename, records in files:
+        for record in records:
+            parts.append(Part(filename, *record))
+    DEVICES.update(parts)
+    LOADED_PREFIXES.add(prefix)
+
+    if dirty:
+        save_cache(INDEX_FILE, index)
+
+
+def _load_prefix(prefix, jobs):
+    if not any(prefix.startswith(p) for p in LOADED_PREFIXES):
+        _populate_devices(prefix, jobs)
+
+
+def find(name, jobs=1):
+    # Device files are named after the family (stm32g4-71_73_74...), so the
+    # first 7 characters of the query select the files that can possibly
+    # hold a match.  Each new prefix loads its files into the index once.
+    _load_prefix(name[:7], jobs)
+    return DEVICES.search(name)
+
+
+def _parse_size(s):
+    s = s.upper().rstrip('B')
+    if s and s[-1] in SIZE_SUFFIXES:
+        return int(s[:-1], 10) * SIZE_SUFFIXES[s[-1]]
+    return int(s, 10)
+
+
+def parse_filter(spec):
+    # A filter is a comma-separated list of terms such as:
+    #
+    #   family=stm32g4,package=LQFP64,flash>=256K,temp=6
+    #
+    # String attributes (family, package, temperature) match by prefix with
+    # = and != so that package=LQFP selects every LQFP package; numeric
+    # attributes (pins, flash) accept all comparison operators.
+    terms = []
+    for term in spec.split(','):
+        if not term.strip():
+            continue
+        m = FILTER_RE.match(term)
+        if not m or m.group(1).lower() not in FILTER_KEYS:
+            raise ValueError('Invalid filter term "%s".' % term.strip())
+
+        key, op, val = FILTER_KEYS[m.group(1).lower()], m.group(2), m.group(3)
+        try:
+            if key == 'pins':
+                val = int(val, 10)
+            elif key == 'flash':
+                val = _parse_size(val)
+            elif op in ('=', '!='):
+                val = val.lower()
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError('Invalid filter term "%s".' % term.strip()) \
+                from None
+        terms.append((key, op, val))
+    return terms
+
+
+def _match_term(part, key, op, val):
+    if key == 'pins':
+        v = part.pin_count
+    elif key == 'flash':
+        v = part.flash
+    else:
+        if key == 'family':
+            v = part.family
+        elif key == 'package':
+            v = part.package or ''
+        else:
+            v = part.identifier.get('temperature', '')
+        return v.lower().startswith(val) == (op == '=')
+
+    return FILTER_OPS[op](v, val)
+
+
+def query(spec, jobs=1):
+    # Answered entirely from the device index; no XML is touched unless the
+    # index has to be built first.  A family term narrows the set of device
+    # files that need to be loaded, otherwise the whole catalogue is used.
+    terms  = parse_filter(spec) if isinstance(spec, str) else spec
+    prefix = ''
+    for key, op, val in terms:
+        if key == 'family' and op == '=':
+            prefix = val[:7]
+    _load_prefix(prefix, jobs)
+
+    return [part for part in DEVICES.search('')
+            if all(_match_term(part, *t) for t in terms)]
+
+
+def get_device(part):
+    # Only the one XML file holding the part is parsed, and it is kept around
+    # in case another part from the same file is requested later.
+    devfile = DEVICE_FILES.get(part.filename)
+    if devfile is None:
+        parser  = modm_devices.parser.DeviceParser()
+        devfile = parser.parse(part.filename)
+        DEVICE_FILES[part.filename] = devfile
+    for device in devfile.get_devices():
+        if device.partname == part.partname:
+            return device
+    raise KeyError(part.partname)
+
+
+def _package_geometry(p, n):
     if any(name in p for name in ('TFBGA', 'UFBGA', 'WLCSP', 'EWLCSP')):
         if n == 240:
             dim = 17    # 240+25
@@ -63,17 +294,83 @@ def make_package(dev):
             dim = 15    # 176+25
         else:
             dim = int(math.ceil(math.sqrt(float(n))))
-        return chip_package.BGA(dim, dim)
+        return chip_package.BGA, (dim, dim)
 
     if any(name in p for name in ('LQFP', 'UFQFPN', 'VFQFPN')):
         dim = int(math.ceil(float(n)/4.))
-        return chip_package.LQFP(dim, dim)
+        return chip_package.LQFP, (dim, dim)
 
     if any(name in p for name in ('TSSOP', 'SO8N')):
         dim = int(math.ceil(float(n)/2.))
-        return chip_package.TSSOP(dim)
+        return chip_package.TSSOP, (dim,)
+
+    return None, ()
 
-    raise KeyError
+
+def summary(dev):
+    # pin_count(), package() and make_package() are all answered from one
+    # immutable summary per part.  If the part is in the device index the
+    # summary is built without touching the gpio driver at all; otherwise
+    # the driver is loaded exactly once.
+    global DRIVER_LOADS_AVOIDED
+
+    s = SUMMARIES.get(dev.partname)
+    if s is not None:
+        DRIVER_LOADS_AVOIDED += 1
+        return s
+
+    part = DEVICES.get(dev.partname)
+    if part is not None and part.package is not None:
+        DRIVER_LOADS_AVOIDED += 1
+        name, n = part.package, part.pin_count
+    else:
+        # Unfortunately, sometimes R means 64 and sometimes it means 68.  So,
+        # we just count the pins.  For some reason, counting the pins goes
+        # slower.  Maybe modm-devices does some deferred loading? Yes it
+        # does. -Niklas
+        try:
+            pkg  = dev.get_driver('gpio')['package'][0]
+            name = pkg['name']
+            n    = len(set(p['position'] for p in pkg['pin']))
+        except Exception:
+            name, n = None, 0
+
+    package_cls, dims = _package_geometry(name, n) if name else (None, ())
+    s = PackageSummary(name, n, package_cls, dims)
+    SUMMARIES[dev.partname] = s
+    return s
+
+
+def pin_count(dev):
+    return summary(dev).pin_count
+
+
+def flash_size(dev):
+    # Dual-bank parts list flash1/flash2 and TrustZone parts alias the same
+    # flash as flash_ns and flash_s; count each physical bank once.
+    total = 0
+    alias = 0
+    for m in (dev.get_driver('core') or {}).get('memory', []):
+        if re.match(r'^flash\d*$', m['name']):
+            total += int(m['size'], 0)
+        elif m['name'] == 'flash_ns':
+            alias += int(m['size'], 0)
+    return total or alias
+
+
+def package(dev):
+    p = summary(dev).name
+    if p is not None:
+        return p
+    raise KeyError('Device %s has unknown package "%s".'
+                   % (dev, dev.identifier.package))
+
+
+def make_package(dev):
+    s = summary(dev)
+    if s.package_cls is None:
+        raise KeyError
+    return s.package_cls(*s.dims)
 
 
 GPIO_DEFAULTS = {
@@ -304,30 +601,70 @@ REFM_TABLE = {
 }
 
 
+# All of REFM_TABLE as one alternation; since every pattern is anchored, the
+# first alternative that matches is the same entry the table order would
+# have picked.  lastindex identifies which alternative that was.
+REFM_RE     = re.compile('|'.join('(%s)' % k for k in REFM_TABLE))
+REFM_VALUES = list(REFM_TABLE.values())
+REFM_CACHE  = {}
+
+GPIO_RESET_TABLES = {}
+NO_GPIO_DEFAULTS  = (0, 0, 0, 0)
+
+
 def get_refm(part):
-    identifier = str(part.identifier)
-    for k, v in REFM_TABLE.items():
-        regex = re.compile(k)
-        if regex.search(identifier):
-            return v
-    raise KeyError
+    identifier = part.partname
+    try:
+        refm = REFM_CACHE[identifier]
+    except KeyError:
+        m    = REFM_RE.search(identifier)
+        refm = REFM_VALUES[m.lastindex - 1] if m else None
+        REFM_CACHE[identifier] = refm
+    if refm is None:
+        raise KeyError
+    return refm
 
 
 def get_gpio_ports(part):
     return GPIO_DEFAULTS[get_refm(part)]['MODER'].keys()
 
 
+def get_gpio_reset_table(part):
+    # Returns {port: ((moder, otyper, ospeedr, pupdr) for pins 0-15)}, built
+    # once per reference manual.  Parts with no known reference manual get
+    # an empty table and all their pins default to (0, 0, 0, 0).
+    try:
+        refm = get_refm(part)
+    except KeyError:
+        return {}
+
+    table = GPIO_RESET_TABLES.get(refm)
+    if table is None:
+        defs  = GPIO_DEFAULTS[refm]
+        table = {}
+        for port, moder in defs['MODER'].items():
+            lanes = gpio_regs.decode_port(moder,
+                                          defs['OTYPER'][port],
+                                          defs['OSPEEDR'][port],
+                                          defs['PUPDR'][port])
+            table[port] = tuple(zip(*lanes[:4]))
+        GPIO_RESET_TABLES[refm] = table
+    return table
+
+
+def get_gpio_reset_words(part, port):
+    # Returns the reset values of the port's registers in
+    # gpio_regs.REGISTERS order; the AFRs always reset to zero.
+    try:
+        defs = GPIO_DEFAULTS[get_refm(part)]
+        return (defs['MODER'][port], defs['OTYPER'][port],
+                defs['OSPEEDR'][port], defs['PUPDR'][port], 0, 0)
+    except KeyError:
+        return (0, 0, 0, 0, 0, 0)
+
+
 def get_gpio_defaults(part, port, pin):
     try:
-        defs    = GPIO_DEFAULTS[get_refm(part)]
-        moder   = defs['MODER'][port]
-        otyper  = defs['OTYPER'][port]
-        ospeedr = defs['OSPEEDR'][port]
-        pupdr   = defs['PUPDR'][port]
-        return ((moder >> (2*pin)) & 0x3,
-                (otyper >> pin) & 0x1,
-                (ospeedr >> (2*pin)) & 0x3,
-                (pupdr >> (2*pin)) & 0x3,
-                )
+        return get_gpio_reset_table(part)[port][pin]
     except KeyError:
-        return (0, 0, 0, 0)
+        return NO_GPIO_DEFAULTS
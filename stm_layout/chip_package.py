@@ -1,216 +1,241 @@
+import bisect
+
 
 BGA_Y_TO_LABEL = 'ABCDEFGHJKLMNPRTUVWY'
 BGA_LABEL_TO_Y = {label: i for i, label in enumerate(BGA_Y_TO_LABEL)}
 
+# {(package class, width, height): {pin key: flat index}}, built the first
+# time a geometry is seen and shared by every package with it.  The keys are
+# in pin order, which is the order jumps cycle through.
+INDEXES = {}
+
+# Grid directions as (dx, dy).
+DIRECTIONS = {
+    'left'  : (-1, 0),
+    'right' : (1, 0),
+    'up'    : (0, -1),
+    'down'  : (0, 1),
+}
+
+
+class Cursor:
+    # A position on a populated cell.  Every move is a lookup in the
+    # package's navigation tables, built by Package.link().
+    def __init__(self, chip, i):
+        self.chip = chip
+        self.i    = i
+
+    @property
+    def pos(self):
+        return divmod(self.i, self.chip.height)
+
+    @property
+    def pin(self):
+        return self.chip.pins[self.i]
+
+    def move(self, direction):
+        self.i = self.chip.moves[direction][self.i]
+
+    def left(self):
+        self.move('left')
+
+    def right(self):
+        self.move('right')
+
+    def up(self):
+        self.move('up')
+
+    def down(self):
+        self.move('down')
+
+    def jump(self, ranks):
+        # Moves to the next pin, in pin order and wrapping around, out of a
+        # sorted list of ranks in package.order.  Returns False if there are
+        # none.
+        if not ranks:
+            return False
+        k      = bisect.bisect_right(ranks, self.chip.rank[self.i])
+        self.i = self.chip.order[ranks[k % len(ranks)]]
+        return True
+
+    def find(self, match):
+        # Moves to the next pin, in pin order, for which match(pin) is true.
+        order = self.chip.order
+        r     = self.chip.rank[self.i]
+        for k in range(1, len(order) + 1):
+            i = order[(r + k) % len(order)]
+            if match(self.chip.pins[i]):
+                self.i = i
+                return True
+        return False
+
+
+class EdgeCursor(Cursor):
+    # A Cursor on a package with its pins around the edge, which can also
+    # step around it: clockwise is down the pin numbers.
+    def clockwise(self):
+        self.move('clockwise')
+
+    def counterclockwise(self):
+        self.move('counterclockwise')
+
 
 class Package:
+    # The grid is stored column by column in one flat list: cell (x, y) is
+    # pins[x*height + y].  Subclasses provide make_index(), which maps every
+    # pin key of the geometry to its flat index, and may set Cursor to a
+    # subclass with moves of their own.
+    Cursor = Cursor
+
     def __init__(self, width, height):
         self.width  = width
         self.height = height
-        self.pins   = []
-        for _ in range(width):
-            self.pins.append([None]*self.height)
-
-
-class BGA(Package):
-    class Cursor:
-        def __init__(self, chip):
-            self.chip = chip
-            self.pos = (-1, 0)
-            self.right()
-
-        @property
-        def pin(self):
-            return self.chip.pins[self.pos[0]][self.pos[1]]
-
-        def move(self, delta):
-            new_pos = self.pos
-            while True:
-                new_pos = (new_pos[0] + delta[0], new_pos[1] + delta[1])
-                if new_pos[0] < 0 or new_pos[0] >= self.chip.width:
-                    return
-                if new_pos[1] < 0 or new_pos[1] >= self.chip.height:
-                    return
-                if self.chip.pins[new_pos[0]][new_pos[1]] is None:
-                    continue
-
-                self.pos = new_pos
-                return
-
-        def left(self):
-            self.move((-1, 0))
-
-        def right(self):
-            self.move((1, 0))
-
-        def up(self):
-            self.move((0, -1))
-
-        def down(self):
-            self.move((0, 1))
-
-    def __init__(self, width, height):
-        super().__init__(width, height)
+        self.pins   = [None]*(width*height)
+        geometry    = (type(self), width, height)
+        if geometry not in INDEXES:
+            INDEXES[geometry] = self.make_index()
+        self.index  = INDEXES[geometry]
+        self.order  = []
+        self.rank   = {}
+        self.moves  = {}
+
+    def make_index(self):
+        raise NotImplementedError
 
     def __getitem__(self, key):
-        x = int(key[1:], 10) - 1
-        y = BGA_LABEL_TO_Y[key[0]]
-        return self.pins[x][y]
+        return self.pins[self.index[key]]
 
     def __setitem__(self, key, val):
-        x = int(key[1:], 10) - 1
-        y = BGA_LABEL_TO_Y[key[0]]
-        self.pins[x][y] = val
+        self.pins[self.index[key]] = val
+
+    def at(self, x, y):
+        return self.pins[x*self.height + y]
+
+    def cells(self):
+        # (x, y, pin) for every populated cell, column by column.
+        h = self.height
+        return [(i // h, i % h, p) for i, p in enumerate(self.pins)
+                if p is not None]
+
+    def link(self):
+        # Builds the navigation tables once all pins are in place: order
+        # lists the populated cells in pin order, rank is the inverse and
+        # moves maps each direction to a list giving, for every cell, the
+        # cell a cursor moves to (itself if there's nowhere to go).
+        self.order = [i for i in self.index.values()
+                      if self.pins[i] is not None]
+        self.rank  = {i: r for r, i in enumerate(self.order)}
+        self.moves = self.make_moves()
+
+    def grid_moves(self):
+        # Moves to the nearest populated cell in a straight line, skipping
+        # holes.  Each line is walked once backwards from its far end,
+        # carrying the last populated cell seen.
+        w     = self.width
+        h     = self.height
+        moves = {}
+        for direction, (dx, dy) in DIRECTIONS.items():
+            table = list(range(w*h))
+            xs    = range(w - 1, -1, -1) if dx > 0 else range(w)
+            ys    = range(h - 1, -1, -1) if dy > 0 else range(h)
+            if dx:
+                lines = [[x*h + y for x in xs] for y in range(h)]
+            else:
+                lines = [[x*h + y for y in ys] for x in range(w)]
+            for line in lines:
+                nearest = None
+                for i in line:
+                    if nearest is not None:
+                        table[i] = nearest
+                    if self.pins[i] is not None:
+                        nearest = i
+            moves[direction] = table
+        return moves
+
+    def make_moves(self):
+        return self.grid_moves()
+
+    def start(self):
+        # The first populated cell of the top row, else the first pin.
+        h = self.height
+        for x in range(self.width):
+            if self.pins[x*h] is not None:
+                return x*h
+        return self.order[0]
 
     def cursor(self):
-        return BGA.Cursor(self)
+        return self.Cursor(self, self.start())
+
+
+class BGA(Package):
+    def make_index(self):
+        # Balls are labelled by row letter and 1-based column: 'A1', 'R12'.
+        # Pin order is row by row.
+        return {'%s%u' % (BGA_Y_TO_LABEL[y], x + 1) : x*self.height + y
+                for y in range(self.height)
+                for x in range(self.width)}
 
 
 class LQFP(Package):
-    class Cursor:
-        def __init__(self, chip):
-            self.chip = chip
-            self.pos  = (0, 1)
-
-        @property
-        def pin(self):
-            return self.chip.pins[self.pos[0]][self.pos[1]]
-
-        def left(self):
-            if self.pos[1] == 0:
-                self.counterclockwise()
-            elif self.pos[1] == self.chip.height - 1:
-                self.clockwise()
-
-        def right(self):
-            if self.pos[1] == 0:
-                self.clockwise()
-            elif self.pos[1] == self.chip.height - 1:
-                self.counterclockwise()
-
-        def up(self):
-            if self.pos[0] == 0:
-                self.clockwise()
-            elif self.pos[0] == self.chip.width - 1:
-                self.counterclockwise()
-
-        def down(self):
-            if self.pos[0] == 0:
-                self.counterclockwise()
-            elif self.pos[0] == self.chip.width - 1:
-                self.clockwise()
-
-        def rotate(self, delta):
-            while True:
-                if self.pos[0] == 0:
-                    self.pos = (0, self.pos[1] - delta)
-                if self.pos[1] == 0:
-                    self.pos = (self.pos[0] + delta, 0)
-                if self.pos[0] == self.chip.width - 1:
-                    self.pos = (self.chip.width - 1, self.pos[1] + delta)
-                if self.pos[1] == self.chip.height - 1:
-                    self.pos = (self.pos[0] - delta, self.chip.height - 1)
-                if self.pin is not None:
-                    return
-
-        def clockwise(self):
-            self.rotate(1)
-
-        def counterclockwise(self):
-            self.rotate(-1)
+    Cursor = EdgeCursor
 
     def __init__(self, width, height):
         super().__init__(width + 2, height + 2)
 
-    def __getitem__(self, key):
-        key = int(key, 10) - 1
-        if 0 <= key < self.height - 2:
-            return self.pins[0][key]
-        key -= self.height - 2
-        if 0 <= key < self.width - 2:
-            return self.pins[key][self.height - 1]
-        key -= self.width - 2
-        if 0 <= key < self.height - 2:
-            return self.pins[self.width - 1][self.height - 1 - key - 1]
-        key -= self.height - 2
-        if 0 <= key < self.width - 2:
-            return self.pins[self.width - 1 - key - 1][0]
-        raise KeyError
-
-    def __setitem__(self, key, val):
-        key = int(key, 10) - 1
-        if 0 <= key < self.height - 2:
-            self.pins[0][key + 1] = val
-            return
-        key -= self.height - 2
-        if 0 <= key < self.width - 2:
-            self.pins[key + 1][self.height - 1] = val
-            return
-        key -= self.width - 2
-        if 0 <= key < self.height - 2:
-            self.pins[self.width - 1][self.height - 1 - key - 1] = val
-            return
-        key -= self.height - 2
-        if 0 <= key < self.width - 2:
-            self.pins[self.width - 1 - key - 1][0] = val
-            return
-        raise KeyError
-
-    def cursor(self):
-        return LQFP.Cursor(self)
+    def make_index(self):
+        # Pins are numbered counterclockwise from the top of the left edge,
+        # which is column 0; the corners stay empty.
+        w     = self.width
+        h     = self.height
+        cells = ([(0, y) for y in range(1, h - 1)] +
+                 [(x, h - 1) for x in range(1, w - 1)] +
+                 [(w - 1, y) for y in range(h - 2, 0, -1)] +
+                 [(x, 0) for x in range(w - 2, 0, -1)])
+        return {str(i + 1) : x*h + y for i, (x, y) in enumerate(cells)}
+
+    def make_moves(self):
+        # Cursors go around the edge: clockwise is down the pin numbers and
+        # counterclockwise up them, wrapping.  The arrow keys map onto these
+        # by edge, e.g. left on the bottom edge is clockwise.
+        w     = self.width
+        h     = self.height
+        n     = len(self.order)
+        cw    = list(range(w*h))
+        ccw   = list(range(w*h))
+        for r, i in enumerate(self.order):
+            cw[i]  = self.order[(r - 1) % n]
+            ccw[i] = self.order[(r + 1) % n]
+
+        moves = {'clockwise'        : cw,
+                 'counterclockwise' : ccw}
+        for direction in DIRECTIONS:
+            moves[direction] = list(range(w*h))
+        for i in self.order:
+            x, y = divmod(i, h)
+            if y == 0:
+                moves['left'][i]  = ccw[i]
+                moves['right'][i] = cw[i]
+            elif y == h - 1:
+                moves['left'][i]  = cw[i]
+                moves['right'][i] = ccw[i]
+            if x == 0:
+                moves['up'][i]    = cw[i]
+                moves['down'][i]  = ccw[i]
+            elif x == w - 1:
+                moves['up'][i]    = ccw[i]
+                moves['down'][i]  = cw[i]
+        return moves
+
+    def start(self):
+        if self.pins[1] is not None:
+            return 1
+        return self.order[0]
 
 
 class TSSOP(Package):
-    class Cursor:
-        def __init__(self, chip):
-            self.chip = chip
-            self.pos = (-1, 0)
-            self.right()
-
-        @property
-        def pin(self):
-            return self.chip.pins[self.pos[0]][self.pos[1]]
-
-        def move(self, delta):
-            new_pos = self.pos
-            while True:
-                new_pos = (new_pos[0] + delta[0], new_pos[1] + delta[1])
-                if new_pos[0] < 0 or new_pos[0] >= 2:
-                    return
-                if new_pos[1] < 0 or new_pos[1] >= self.chip.height:
-                    return
-                if self.chip.pins[new_pos[0]][new_pos[1]] is None:
-                    continue
-
-                self.pos = new_pos
-                return
-
-        def left(self):
-            self.move((-1, 0))
-
-        def right(self):
-            self.move((1, 0))
-
-        def up(self):
-            self.move((0, -1))
-
-        def down(self):
-            self.move((0, 1))
-
     def __init__(self, height):
         super().__init__(2, height)
 
-    def __getitem__(self, key):
-        key = int(key, 10) - 1
-        x   = key // self.height
-        y   = key % self.height
-        return self.pins[x][y]
-
-    def __setitem__(self, key, val):
-        key = int(key, 10) - 1
-        x   = key // self.height
-        y   = key % self.height
-        self.pins[x][y] = val
-
-    def cursor(self):
-        return TSSOP.Cursor(self)
+    def make_index(self):
+        # Pins 1 to height down the left side, then the right side.
+        return {str(i + 1) : i for i in range(2*self.height)}
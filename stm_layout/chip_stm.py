@@ -1,20 +1,160 @@
 #!/usr/bin/env python3
+import collections
+import sys
+
 from . import chip_db
+from . import gpio_regs
+
+
+# Choice labels are shared by every GPIO of every chip.
+MODE_CHOICES     = ('GPI', 'GPO', 'Alternate', 'Analog')
+SPEED_CHOICES    = ('Low', 'Med', 'High', 'Very High')
+TYPE_CHOICES     = ('Push-Pull', 'Open-Drain')
+RESISTOR_CHOICES = ('None', 'Pull-Up', 'Pull-Down')
+NCHOICES         = (len(MODE_CHOICES) + len(SPEED_CHOICES) +
+                    len(TYPE_CHOICES) + len(RESISTOR_CHOICES))
+
+# Function tables shared between pins and chips; see _intern_fns().
+FN_TABLES = {}
+
+
+def _intern_fns(fns):
+    fns = tuple(sys.intern(f) for f in fns)
+    return FN_TABLES.setdefault(fns, fns)
+
+
+# The signals of an alternate-function string; some AFs carry several
+# signals separated by '/'.
+FN_SIGNALS = {'-' : ()}
+
+
+def fn_signals(f):
+    signals = FN_SIGNALS.get(f)
+    if signals is None:
+        signals = FN_SIGNALS[f] = tuple(sys.intern(s) for s in f.split('/'))
+    return signals
 
 
 class Choice:
+    __slots__ = ('name', 'choices', 'default_val', 'val', 'enabled_mask')
+
     def __init__(self, name, choices, val):
-        self.name        = name
-        self.choices     = choices
-        self.default_val = val
-        self.val         = val
-        self.enabled     = [True for _ in choices]
+        self.name         = name
+        self.choices      = choices
+        self.default_val  = val
+        self.val          = val
+        self.enabled_mask = (1 << len(choices)) - 1
+
+    def is_enabled(self, i):
+        return bool((self.enabled_mask >> i) & 1)
+
+    def enable_all(self):
+        self.enabled_mask = (1 << len(self.choices)) - 1
+
+    def disable_all(self):
+        self.enabled_mask = 0
 
     def reset(self):
         self.val = self.default_val
 
 
+class PortState:
+    # Live shadow of one GPIO port's registers.  Pins update their fields in
+    # per-pin lanes (mode, type, speed, pull and AF, in decode_port() order)
+    # and the words are encoded from them in one batch when next asked for.
+    # Only configured ("touched") pins have nonzero fields, so that the words
+    # can be OR-ed into a read-modify-write directly.
+    __slots__ = ('name', 'lanes', 'touched', 'version', '_words',
+                 '_words_version')
+
+    def __init__(self, name):
+        self.name           = name
+        self.lanes          = tuple([0]*16 for _ in range(5))
+        self.touched        = 0x0000
+        self.version        = 0
+        self._words         = None
+        self._words_version = None
+
+    def set_pin(self, n, touched, mode=0, otype=0, speed=0, pull=0, af=0):
+        if touched:
+            self.touched |= (1 << n)
+        else:
+            self.touched &= ~(1 << n)
+            mode = otype = speed = pull = af = 0
+        modes, types, speeds, pulls, afs = self.lanes
+        modes[n]      = mode
+        types[n]      = otype
+        speeds[n]     = speed
+        pulls[n]      = pull
+        afs[n]        = af
+        self.version += 1
+
+    def words(self):
+        # Returns the words in gpio_regs.REGISTERS order.
+        if self._words_version != self.version:
+            self._words         = gpio_regs.encode_port(*self.lanes)
+            self._words_version = self.version
+        return self._words
+
+    def registers(self):
+        # Returns [(register, keep_mask, value)] in gpio_regs.REGISTERS order,
+        # where the register should become (register & keep_mask) | value.
+        mask_1, mask_2, mask_4 = gpio_regs.keep_masks(self.touched)
+        masks = (mask_2, mask_1, mask_2, mask_2,
+                 mask_4 & 0xFFFFFFFF, mask_4 >> 32)
+        return list(zip(gpio_regs.REGISTERS, masks, self.words()))
+
+
+class SignalAssignments:
+    # Live map of which pins currently drive each signal through their
+    # selected alternate function.  GPIOs report changes through assign() and
+    # unassign(), so a conflict (a signal on more than one pin) is found in
+    # O(1) per change instead of by rescanning the chip.
+    def __init__(self):
+        self.pins           = collections.defaultdict(set)
+        self.conflicts      = set()
+        self._pin_conflicts = collections.Counter()
+
+    def assign(self, pin, signals):
+        for s in signals:
+            pins = self.pins[s]
+            pins.add(pin)
+            if len(pins) == 2:
+                self.conflicts.add(s)
+                for p in pins:
+                    self._pin_conflicts[p] += 1
+            elif len(pins) > 2:
+                self._pin_conflicts[pin] += 1
+
+    def unassign(self, pin, signals):
+        for s in signals:
+            pins = self.pins[s]
+            if len(pins) >= 2:
+                self._decrement(pin)
+            pins.discard(pin)
+            if len(pins) == 1:
+                self.conflicts.discard(s)
+                self._decrement(next(iter(pins)))
+            elif not pins:
+                del self.pins[s]
+
+    def _decrement(self, pin):
+        self._pin_conflicts[pin] -= 1
+        if not self._pin_conflicts[pin]:
+            del self._pin_conflicts[pin]
+
+    def is_conflicted(self, pin):
+        return pin in self._pin_conflicts
+
+    def is_signal_conflicted(self, signal):
+        return signal in self.conflicts
+
+
 class Pin:
+    # _attr holds the curses UI's per-pin display attributes.
+    __slots__ = ('name', 'full_name', 'key', '_default', '_altfn', 'alt_fns',
+                 'add_fns', '_choices', '_nchoices', '_attr')
+
     def __init__(self, name, key, alt_fns, add_fns, full_name):
         super().__init__()
         self.name      = name
@@ -24,27 +164,36 @@ class Pin:
         self._altfn    = None
         self.alt_fns   = alt_fns
         self.add_fns   = add_fns
-        self._choices  = []
+        self._choices  = ()
         self._nchoices = 0
 
 
 class GPIO(Pin):
-    def __init__(self, name, key, alt_fns, add_fns, full_name, part):
+    # _port is the PortState and _signals the SignalAssignments this pin
+    # reports into; both are attached by Chip.  _assigned holds the signals
+    # last reported to _signals.
+    __slots__ = ('_gpio', '_gpionum', '_port', '_signals', '_assigned')
+
+    def __init__(self, name, key, alt_fns, add_fns, full_name, reset_table):
         super().__init__(name, key, alt_fns, add_fns, full_name)
+        self._port     = None
+        self._signals  = None
+        self._assigned = ()
         gpio = name[:2]
         try:
             n                             = int(name[2:])
-            moder, otyper, ospeedr, pupdr = chip_db.get_gpio_defaults(part,
-                                                                      gpio, n)
+            moder, otyper, ospeedr, pupdr = (reset_table[gpio][n]
+                                             if gpio in reset_table else
+                                             chip_db.NO_GPIO_DEFAULTS)
             self._gpio                    = gpio
             self._gpionum                 = n
-            self._choices = [
-                Choice('Mode', ['GPI', 'GPO', 'Alternate', 'Analog'], moder),
-                Choice('Speed', ['Low', 'Med', 'High', 'Very High'], ospeedr),
-                Choice('Type', ['Push-Pull', 'Open-Drain'], otyper),
-                Choice('Resistor', ['None', 'Pull-Up', 'Pull-Down'], pupdr),
-                ]
-            self._nchoices = sum(len(c.choices) for c in self._choices)
+            self._choices = (
+                Choice('Mode', MODE_CHOICES, moder),
+                Choice('Speed', SPEED_CHOICES, ospeedr),
+                Choice('Type', TYPE_CHOICES, otyper),
+                Choice('Resistor', RESISTOR_CHOICES, pupdr),
+                )
+            self._nchoices = NCHOICES
             if self._choices[0].val == 2:
                 self._altfn = 0
         except ValueError:
@@ -66,7 +215,7 @@ class GPIO(Pin):
         self._default = False
         for choice in self._choices:
             if n < len(choice.choices):
-                if choice.enabled[n]:
+                if choice.is_enabled(n):
                     choice.val = n
                 break
             n -= len(choice.choices)
@@ -93,32 +242,59 @@ class GPIO(Pin):
         if not self._choices:
             return
 
+        mode, speed, otype, resistor = self._choices
         if self._altfn is not None:
-            self._choices[0].enabled = [False, False, True, False]
-            self._choices[0].val     = 2
+            mode.enabled_mask = (1 << 2)
+            mode.val          = 2
         else:
-            self._choices[0].enabled = [True for _ in self._choices[0].choices]
+            mode.enable_all()
 
-        if self._choices[0].val in (1, 2):
+        if mode.val in (1, 2):
             # GPO or AF.  Everything is enabled.
-            self._choices[1].enabled = [True for _ in self._choices[1].choices]
-            self._choices[2].enabled = [True for _ in self._choices[2].choices]
-            self._choices[3].enabled = [True for _ in self._choices[3].choices]
-        elif self._choices[0].val == 0:
+            speed.enable_all()
+            otype.enable_all()
+            resistor.enable_all()
+        elif mode.val == 0:
             # GPI.  Only resistor is enabled.
-            self._choices[1].enabled = [False for _ in self._choices[1].choices]
-            self._choices[2].enabled = [False for _ in self._choices[2].choices]
-            self._choices[3].enabled = [True for _ in self._choices[3].choices]
-            self._choices[1].val     = self._choices[1].default_val
-            self._choices[2].val     = self._choices[2].default_val
-        elif self._choices[0].val == 3:
+            speed.disable_all()
+            otype.disable_all()
+            resistor.enable_all()
+            speed.val = speed.default_val
+            otype.val = otype.default_val
+        elif mode.val == 3:
             # Analog.  Nothing enabled.
-            self._choices[1].enabled = [False for _ in self._choices[1].choices]
-            self._choices[2].enabled = [False for _ in self._choices[2].choices]
-            self._choices[3].enabled = [False for _ in self._choices[3].choices]
-            self._choices[1].val     = self._choices[1].default_val
-            self._choices[2].val     = self._choices[2].default_val
-            self._choices[3].val     = self._choices[3].default_val
+            speed.disable_all()
+            otype.disable_all()
+            resistor.disable_all()
+            speed.val    = speed.default_val
+            otype.val    = otype.default_val
+            resistor.val = resistor.default_val
+
+        # Every state change funnels through here, so this keeps the port's
+        # register shadow and the chip's signal assignments in step with what
+        # the UI shows.
+        self._sync_port()
+        self._sync_signals()
+
+    def _sync_port(self):
+        if self._port is None:
+            return
+        mode, speed, otype, resistor = self._choices
+        self._port.set_pin(self._gpionum, not self._default, mode.val,
+                           otype.val, speed.val, resistor.val,
+                           self._altfn or 0)
+
+    def _sync_signals(self):
+        if self._signals is None:
+            return
+        if self._altfn is None or self._altfn >= len(self.alt_fns):
+            signals = ()
+        else:
+            signals = fn_signals(self.alt_fns[self._altfn])
+        if signals != self._assigned:
+            self._signals.unassign(self, self._assigned)
+            self._signals.assign(self, signals)
+            self._assigned = signals
 
 
 class Chip:
@@ -129,80 +305,114 @@ class Chip:
         self.width   = self.chip.width
         self.height  = self.chip.height
         self.pins    = pins
-        self.pin_map = self.chip.pins
         for k, p in pins.items():
             self.chip[k] = p
+        self.chip.link()
+        self.cells        = self.chip.cells()
+        self._signatures  = None
+        self._signal_pins = None
+
+        self.ports   = {}
+        self.signals = SignalAssignments()
+        for p in pins.values():
+            if not hasattr(p, '_gpio'):
+                continue
+            if p._gpio not in self.ports:
+                self.ports[p._gpio] = PortState(p._gpio)
+            p._port    = self.ports[p._gpio]
+            p._signals = self.signals
+            p._sync_port()
+            p._sync_signals()
+
+        # {port: ranks in self.chip.order of its GPIOs}, for Cursor.jump().
+        self.port_ranks = collections.defaultdict(list)
+        for r, i in enumerate(self.chip.order):
+            p = self.chip.pins[i]
+            if hasattr(p, '_gpio'):
+                self.port_ranks[p._gpio].append(r)
 
     def cursor(self):
         return self.chip.cursor()
 
-    def serialize_settings(self):
-        moder     = {}
-        otyper    = {}
-        ospeedr   = {}
-        pupdr     = {}
-        altfnr    = {}
-        mask_1    = {}
-        mask_2    = {}
-        mask_4    = {}
-        keys      = chip_db.get_gpio_ports(self.part)
-        for k in keys:
-            moder[k]   = 0x00000000
-            otyper[k]  = 0x00000000
-            ospeedr[k] = 0x00000000
-            pupdr[k]   = 0x00000000
-            altfnr[k]  = 0x0000000000000000
-            mask_1[k]  = 0xFFFFFFFF
-            mask_2[k]  = 0xFFFFFFFF
-            mask_4[k]  = 0xFFFFFFFFFFFFFFFF
+    def pin_signatures(self):
+        # Hash of each pin's name and functions, computed once so that one
+        # chip can be compared against many others cheaply.  The functions
+        # are hashed as sets, as their order within an AF slot or the
+        # additional functions doesn't matter.
+        if self._signatures is None:
+            self._signatures = {
+                k: hash((p.full_name,
+                         frozenset((af, s) for af, f in enumerate(p.alt_fns)
+                                   for s in f.split('/')),
+                         frozenset(p.add_fns)))
+                for k, p in self.pins.items()}
+        return self._signatures
+
+    def signal_pins(self):
+        # Reverse index of the alternate functions: {signal: [(pin, af)]},
+        # built once per chip.
+        if self._signal_pins is None:
+            index = collections.defaultdict(list)
+            for p in self.pins.values():
+                for af, f in enumerate(p.alt_fns):
+                    for s in fn_signals(f):
+                        index[s].append((p, af))
+            self._signal_pins = dict(index)
+        return self._signal_pins
 
+    def reset(self):
+        # Returns every GPIO to its reset configuration so that the chip can
+        # be reused for another configuration.
         for p in self.pins.values():
-            if p._default:
-                continue
-            if not hasattr(p, '_gpio'):
-                continue
+            if p._choices:
+                p._reset()
 
-            port           = p._gpio
-            n              = p._gpionum
-            mask_1[port]  &= ~(0x1 <<   n)
-            mask_2[port]  &= ~(0x3 << 2*n)
-            mask_4[port]  &= ~(0xF << 4*n)
-            moder[port]   |= (p._choices[0].val << 2*n)
-            otyper[port]  |= (p._choices[2].val << 1*n)
-            ospeedr[port] |= (p._choices[1].val << 2*n)
-            pupdr[port]   |= (p._choices[3].val << 2*n)
-            if p._altfn is not None:
-                altfnr[port] |= (p._altfn << 4*n)
-
-        s     = ''
-        for port in keys:
-            if mask_2[port] == 0xFFFFFFFF:
-                continue
-            s += '%s.MODER   = (%s.MODER   & 0x%08X) | 0x%08X\n' % (
-                port, port, mask_2[port], moder[port])
-            s += '%s.OTYPER  = (%s.OTYPER  & 0x%08X) | 0x%08X\n' % (
-                port, port, mask_1[port], otyper[port])
-            s += '%s.OSPEEDR = (%s.OSPEEDR & 0x%08X) | 0x%08X\n' % (
-                port, port, mask_2[port], ospeedr[port])
-            s += '%s.PUPDR   = (%s.PUPDR   & 0x%08X) | 0x%08X\n' % (
-                port, port, mask_2[port], pupdr[port])
-            m = (mask_4[port] >> 0) & 0xFFFFFFFF
-            if m != 0xFFFFFFFF:
-                s += '%s.AFRL    = (%s.AFRL    & 0x%08X) | 0x%08X\n' % (
-                    port, port,
-                    (mask_4[port] >>  0) & 0xFFFFFFFF,
-                    (altfnr[port] >>  0) & 0xFFFFFFFF)
-            m = (mask_4[port] >> 32) & 0xFFFFFFFF
-            if m != 0xFFFFFFFF:
-                s += '%s.AFRH    = (%s.AFRH    & 0x%08X) | 0x%08X\n' % (
-                    port, port,
-                    (mask_4[port] >> 32) & 0xFFFFFFFF,
-                    (altfnr[port] >> 32) & 0xFFFFFFFF)
+    def gpio_ports(self):
+        # Port names in reference-manual order, or in sorted order for parts
+        # with no known reference manual.
+        try:
+            return list(chip_db.get_gpio_ports(self.part))
+        except KeyError:
+            return sorted(self.ports)
+
+    def serialize_settings(self):
+        s = ''
+        for port in self.gpio_ports():
+            state = self.ports.get(port)
+            if state is not None:
+                s += format_port(state)
         return s
 
 
-def make_chip(part):
+def format_port(state):
+    if not state.touched:
+        return ''
+
+    port = state.name
+    moder, otyper, ospeedr, pupdr, afrl, afrh = state.words()
+    mask_1, mask_2, mask_4 = gpio_regs.keep_masks(state.touched)
+    s  = '%s.MODER   = (%s.MODER   & 0x%08X) | 0x%08X\n' % (
+        port, port, mask_2, moder)
+    s += '%s.OTYPER  = (%s.OTYPER  & 0x%08X) | 0x%08X\n' % (
+        port, port, mask_1, otyper)
+    s += '%s.OSPEEDR = (%s.OSPEEDR & 0x%08X) | 0x%08X\n' % (
+        port, port, mask_2, ospeedr)
+    s += '%s.PUPDR   = (%s.PUPDR   & 0x%08X) | 0x%08X\n' % (
+        port, port, mask_2, pupdr)
+    m = (mask_4 >> 0) & 0xFFFFFFFF
+    if m != 0xFFFFFFFF:
+        s += '%s.AFRL    = (%s.AFRL    & 0x%08X) | 0x%08X\n' % (
+            port, port, m, afrl)
+    m = (mask_4 >> 32) & 0xFFFFFFFF
+    if m != 0xFFFFFFFF:
+        s += '%s.AFRH    = (%s.AFRH    & 0x%08X) | 0x%08X\n' % (
+            port, port, m, afrh)
+    return s
+
+
+def make_pins(part):
     gpio_driver = part.get_driver('gpio')
+    reset_table = chip_db.get_gpio_reset_table(part)
 
     gpios = {}
     for gpio in gpio_driver['gpio']:
@@ -227,7 +437,7 @@ def make_chip(part):
         # GPIO pins don't have a type and non-GPIOs have nothing to extract,
         # so assign them directly.
         if 'type' in p:
-            pins[key] = Pin(full_name, key, [], [], full_name)
+            pins[key] = Pin(full_name, key, (), (), full_name)
             continue
 
         # Extract the short name and the GPIO key from the full name.  Sample
@@ -270,7 +480,21 @@ def make_chip(part):
                 add_fns.append(f)
 
         # Assign the final pin.
-        pins[key] = GPIO(short_name, key, alt_fns, add_fns, full_name, part)
+        pins[key] = GPIO(sys.intern(short_name), key, _intern_fns(alt_fns),
+                         _intern_fns(add_fns), full_name, reset_table)
 
-    pkg = chip_db.make_package(part)
+    return pins
+
+
+def make_chip(part):
+    pins = make_pins(part)
+    pkg  = chip_db.make_package(part)
     return Chip(part, pkg, pins)
+
+
+def load_chip(partname, jobs=1):
+    part = chip_db.find(partname, jobs=jobs)
+    part = next((p for p in part if p.partname == partname), None)
+    if part is None:
+        raise KeyError(partname)
+    return make_chip(chip_db.get_device(part))
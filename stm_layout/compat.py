@@ -0,0 +1,144 @@
+import collections
+import csv
+import hashlib
+import json
+
+import modm_devices.parser
+
+from . import chip_db
+from . import chip_stm
+
+
+# Matrix cell codes, read as "row <code> column":
+#
+#   =   identical pinouts
+#   >   the row part is a drop-in replacement for the column part: same
+#       power/ground/GPIO placement and a superset of its functions
+#   <   the column part is a drop-in replacement for the row part
+#   f   same placement, but neither part's functions cover the other's
+#       (footprint-compatible only)
+#       (empty) different placement
+SAME         = '='
+SUPERSET     = '>'
+SUBSET       = '<'
+FOOTPRINT    = 'f'
+INCOMPATIBLE = ''
+
+PartPinout = collections.namedtuple('PartPinout',
+                                    ['partname', 'package', 'placement',
+                                     'functions', 'function_hash'])
+
+
+def _digest(obj):
+    # hash() is salted per process, so pool workers need a stable digest.
+    return hashlib.blake2b(json.dumps(obj, sort_keys=True).encode(),
+                           digest_size=16).hexdigest()
+
+
+def _pinout(device):
+    pins      = chip_stm.make_pins(device)
+    placement = sorted((key, p.name) for key, p in pins.items())
+    functions = {}
+    for key, p in pins.items():
+        fns = ['AF%u:%s' % (af, s) for af, f in enumerate(p.alt_fns)
+               for s in f.split('/') if s != '-']
+        functions[key] = sorted(fns + list(p.add_fns))
+    return PartPinout(device.partname, chip_db.package(device),
+                      _digest(placement), functions, _digest(functions))
+
+
+def _pinouts_file(filename):
+    parser  = modm_devices.parser.DeviceParser()
+    devfile = parser.parse(filename)
+    pinouts = []
+    skipped = []
+    for device in devfile.get_devices():
+        try:
+            pinouts.append(_pinout(device))
+        except KeyError:
+            # make_pins() or chip_db.package() couldn't read the pin data.
+            skipped.append(device.partname)
+    return pinouts, skipped
+
+
+def _covers(big, small):
+    return all(set(big.functions.get(key, ())).issuperset(fns)
+               for key, fns in small.functions.items())
+
+
+def _package_matrix(group):
+    # The matrix for the PartPinouts of one package.  Parts with equal
+    # functions can still differ in placement, so representatives and the
+    # cover relation are keyed by both digests.
+    reps = {}
+    for po in group:
+        reps.setdefault((po.placement, po.function_hash), po)
+
+    covers = {}
+    for ka, a in reps.items():
+        for kb, b in reps.items():
+            if a is not b and a.placement == b.placement:
+                covers[ka, kb] = _covers(a, b)
+
+    matrix = []
+    for a in group:
+        ka  = (a.placement, a.function_hash)
+        row = []
+        for b in group:
+            kb = (b.placement, b.function_hash)
+            if a.placement != b.placement:
+                row.append(INCOMPATIBLE)
+            elif a.function_hash == b.function_hash:
+                row.append(SAME)
+            elif covers[ka, kb]:
+                row.append(SUPERSET)
+            elif covers[kb, ka]:
+                row.append(SUBSET)
+            else:
+                row.append(FOOTPRINT)
+        matrix.append(row)
+    return matrix
+
+
+def compat_matrix(prefix, jobs=1):
+    # Returns ({package: (partnames, matrix)}, skipped partnames) for every
+    # part matching prefix.
+    # Parts are bucketed by placement digest and then by function digest, so
+    # full per-pin comparisons only happen between distinct function sets
+    # that share a placement; everything else is decided by the digests.
+    parts     = chip_db.find(prefix, jobs=jobs)
+    wanted    = {p.partname for p in parts}
+    filenames = sorted({p.filename for p in parts})
+    pinouts   = []
+    skipped   = []
+    for file_pinouts, file_skipped in chip_db.map_files(_pinouts_file,
+                                                        filenames, jobs):
+        pinouts += [po for po in file_pinouts if po.partname in wanted]
+        skipped += [p for p in file_skipped if p in wanted]
+
+    groups = collections.defaultdict(list)
+    for po in pinouts:
+        groups[po.package].append(po)
+
+    result = {}
+    for package_name in sorted(groups):
+        group = sorted(groups[package_name], key=lambda po: po.partname)
+        result[package_name] = ([po.partname for po in group],
+                                _package_matrix(group))
+    return result, sorted(skipped)
+
+
+def write_csv(result, f):
+    w = csv.writer(f)
+    for package_name, (partnames, matrix) in result.items():
+        w.writerow([package_name] + partnames)
+        for partname, row in zip(partnames, matrix):
+            w.writerow([partname] + row)
+        w.writerow([])
+
+
+def write_json(result, f):
+    json.dump({package_name: {'parts' : partnames, 'matrix' : matrix}
+               for package_name, (partnames, matrix) in result.items()},
+              f, separators=(',', ':'))
+    f.write('\n')
@@ -0,0 +1,105 @@
+import collections
+import time
+
+from . import chip_db
+from . import chip_stm
+from . import pin_config
+
+
+# Configs are checked in batches of at most this many per worker task.
+# Batches hold configs for a single part, and each worker keeps the chips it
+# has built in CHIPS, so a part is built at most once per worker however its
+# configs are split.  Configs are carried with their index in the argument
+# list, so a path given twice gets two results.
+BATCH_SIZE = 32
+CHIPS      = {}
+
+Result = collections.namedtuple('Result',
+                                ['path', 'part', 'problems', 'seconds'])
+
+
+def _check_batch(batch):
+    partname, configs = batch
+    results = []
+    t0      = time.perf_counter()
+    chip    = CHIPS.get(partname)
+    if chip is None:
+        try:
+            chip = chip_stm.load_chip(partname)
+        except KeyError:
+            chip = None
+        CHIPS[partname] = chip
+    build = time.perf_counter() - t0
+
+    for i, path, pins in configs:
+        t0 = time.perf_counter()
+        if chip is None:
+            problems = [pin_config.Problem(pin_config.UNKNOWN_PART, None,
+                                           'no device found for "%s"' %
+                                           partname)]
+        else:
+            chip.reset()
+            problems = pin_config.check_config(chip, pins)
+        results.append((i, Result(path, partname, problems,
+                                  time.perf_counter() - t0)))
+
+    # The chip build is charged to the first config that needed it.
+    if results:
+        i, r       = results[0]
+        results[0] = (i, r._replace(seconds=r.seconds + build))
+    return results
+
+
+def check_files(paths, partname=None, jobs=1):
+    # Returns a Result for every path, in order.  partname overrides any
+    # "part" given in the configs.
+    results = [None]*len(paths)
+    groups  = collections.defaultdict(list)
+    for i, path in enumerate(paths):
+        t0 = time.perf_counter()
+        try:
+            part, pins = pin_config.load_config(path)
+        except (OSError, ValueError) as e:
+            results[i] = Result(path, partname, [
+                pin_config.Problem(pin_config.BAD_FILE, None, str(e))],
+                                time.perf_counter() - t0)
+            continue
+        part = partname or part
+        if part is None:
+            results[i] = Result(path, None, [
+                pin_config.Problem(pin_config.UNKNOWN_PART, None,
+                                   'no part given')],
+                                time.perf_counter() - t0)
+            continue
+        groups[part].append((i, path, pins))
+
+    # Load the device index up front so that workers inherit it rather than
+    # each reading it again.
+    for part in groups:
+        chip_db.find(part, jobs=jobs)
+
+    batches = []
+    for part in sorted(groups):
+        configs = groups[part]
+        for i in range(0, len(configs), BATCH_SIZE):
+            batches.append((part, configs[i:i + BATCH_SIZE]))
+    for batch_results in chip_db.map_files(_check_batch, batches, jobs):
+        for i, r in batch_results:
+            results[i] = r
+    return results
+
+
+def make_report(results, seconds):
+    files = []
+    for r in results:
+        files.append({'file'     : r.path,
+                      'part'     : r.part,
+                      'ok'       : not r.problems,
+                      'seconds'  : round(r.seconds, 6),
+                      'problems' : [{'kind'    : p.kind,
+                                     'pin'     : p.pin,
+                                     'message' : p.message}
+                                    for p in r.problems]})
+    return {'ok'      : all(f['ok'] for f in files),
+            'seconds' : round(seconds, 6),
+            'files'   : files}
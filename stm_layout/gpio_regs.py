@@ -0,0 +1,108 @@
+# Bulk codec between the GPIO register words of one port and 16 per-pin
+# lanes.  Rather than shifting and masking once per pin, decoding splits each
+# register word into bytes and expands every byte through a lookup table that
+# yields all of the lanes it holds at once (8 one-bit, 4 two-bit or 2
+# four-bit fields).  Encoding turns each lane into one byte per pin and
+# squeezes the gaps out of the resulting integer in four shift-and-mask
+# steps rather than sixteen.
+def _make_decode_table(width):
+    mask = (1 << width) - 1
+    return [tuple((b >> i) & mask for i in range(0, 8, width))
+            for b in range(256)]
+
+
+def _make_spread_table(width):
+    # Expands each bit of a byte into a field of `width` ones.
+    mask = (1 << width) - 1
+    return [sum(mask << (i*width) for i in range(8) if b & (1 << i))
+            for b in range(256)]
+
+
+def _make_pack_steps(width, nlanes):
+    # For nlanes lanes of 16 bytes each, one field of `width` bits per byte:
+    # step j merges pairs of runs of 2**j packed fields by shifting the upper
+    # run down over the gap, leaving each lane's fields contiguous in the
+    # low 16*width bits of its 128.
+    steps = []
+    for j in range(4):
+        group = 16 << j
+        keep  = (1 << (width << (j + 1))) - 1
+        mask  = sum(keep << i for i in range(0, 128*nlanes, group))
+        steps.append(((8 - width) << j, mask))
+    return tuple(steps)
+
+
+DECODE_1 = _make_decode_table(1)
+DECODE_2 = _make_decode_table(2)
+DECODE_4 = _make_decode_table(4)
+SPREAD_2 = _make_spread_table(2)
+SPREAD_4 = _make_spread_table(4)
+PACK_1   = _make_pack_steps(1, 1)
+PACK_2   = _make_pack_steps(2, 3)
+PACK_4   = _make_pack_steps(4, 1)
+
+REGISTERS = ('MODER', 'OTYPER', 'OSPEEDR', 'PUPDR', 'AFRL', 'AFRH')
+
+
+# The byte-at-a-time loops are unrolled; at 16 lanes per port the loop
+# overhead would otherwise cost more than the table lookups save.
+def _decode_1(w):
+    b = w.to_bytes(2, 'little')
+    return DECODE_1[b[0]] + DECODE_1[b[1]]
+
+
+def _decode_2(w):
+    b = w.to_bytes(4, 'little')
+    return DECODE_2[b[0]] + DECODE_2[b[1]] + DECODE_2[b[2]] + DECODE_2[b[3]]
+
+
+def _decode_4(w):
+    b = w.to_bytes(8, 'little')
+    return (DECODE_4[b[0]] + DECODE_4[b[1]] + DECODE_4[b[2]] +
+            DECODE_4[b[3]] + DECODE_4[b[4]] + DECODE_4[b[5]] +
+            DECODE_4[b[6]] + DECODE_4[b[7]])
+
+
+def _pack(lanes, steps):
+    x = int.from_bytes(lanes, 'little')
+    for shift, mask in steps:
+        x = (x | (x >> shift)) & mask
+    return x
+
+
+def decode_port(moder, otyper, ospeedr, pupdr, afrl=0, afrh=0):
+    # Returns the (mode, type, speed, pull, af) lanes for pins 0-15 as
+    # 16-tuples.
+    return (_decode_2(moder),
+            _decode_1(otyper & 0xFFFF),
+            _decode_2(ospeedr),
+            _decode_2(pupdr),
+            _decode_4(afrl | (afrh << 32)),
+            )
+
+
+def encode_port(modes, types, speeds, pulls, afs):
+    # Inverse of decode_port(); accepts any 16-element sequences of field
+    # values and returns the words in REGISTERS order.  The three 2-bit
+    # registers are packed together, 128 bits apart.
+    w2  = _pack(bytes(modes) + bytes(speeds) + bytes(pulls), PACK_2)
+    afr = _pack(bytes(afs), PACK_4)
+    return (w2 & 0xFFFFFFFF,
+            _pack(bytes(types), PACK_1),
+            (w2 >> 128) & 0xFFFFFFFF,
+            w2 >> 256,
+            afr & 0xFFFFFFFF,
+            afr >> 32,
+            )
+
+
+def keep_masks(touched):
+    # Given a 16-bit mask of configured pins, returns the masks of register
+    # bits to preserve in a read-modify-write of the 1-, 2- and 4-bit-per-pin
+    # registers.  The 4-bit mask covers AFRH:AFRL as one 64-bit value.
+    lo = touched & 0xFF
+    hi = touched >> 8
+    return (~touched & 0xFFFFFFFF,
+            ~(SPREAD_2[lo] | (SPREAD_2[hi] << 16)) & 0xFFFFFFFF,
+            ~(SPREAD_4[lo] | (SPREAD_4[hi] << 32)) & 0xFFFFFFFFFFFFFFFF,
+            )
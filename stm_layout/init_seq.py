@@ -0,0 +1,72 @@
+import collections
+
+from . import chip_db
+
+
+# Registers are written in this order within a port so that a pin only
+# switches into its new mode (MODER, last) once its alternate function,
+# output type, speed and pull are already in place.
+INIT_ORDER = ('AFRL', 'AFRH', 'OTYPER', 'OSPEEDR', 'PUPDR', 'MODER')
+
+# keep == 0 means a plain write of value; anything else is a
+# read-modify-write: reg = (reg & keep) | value.
+InitWrite = collections.namedtuple('InitWrite',
+                                   ['port', 'register', 'keep', 'value'])
+
+
+def rmw_accesses(state):
+    # Register accesses made by chip_stm.format_port()'s output for the port:
+    # a read and a write for every register it emits.
+    if not state.touched:
+        return 0
+    return 2 * sum(1 for r, keep, _ in state.registers()
+                   if keep != 0xFFFFFFFF or r not in ('AFRL', 'AFRH'))
+
+
+def plan_port(state, reset, assume_reset=True):
+    # Returns the InitWrites for one PortState.  reset holds the port's reset
+    # words in gpio_regs.REGISTERS order.
+    #
+    # With assume_reset the registers are known to still hold their reset
+    # values (i.e. this runs right after the port comes out of reset), so
+    # every register collapses to a plain write of its final value and is
+    # dropped altogether when that equals the reset value.  Otherwise only
+    # registers that are left entirely alone are dropped and only fully
+    # covered ones become plain writes.
+    if not state.touched:
+        return []
+
+    regs   = {r: (keep, value, rst) for (r, keep, value), rst
+              in zip(state.registers(), reset)}
+    writes = []
+    for r in INIT_ORDER:
+        keep, value, rst = regs[r]
+        if assume_reset:
+            value = (rst & keep) | value
+            if value != rst:
+                writes.append(InitWrite(state.name, r, 0, value))
+        elif keep == 0:
+            writes.append(InitWrite(state.name, r, 0, value))
+        elif keep != 0xFFFFFFFF:
+            writes.append(InitWrite(state.name, r, keep, value))
+    return writes
+
+
+def accesses(writes):
+    return sum(1 if w.keep == 0 else 2 for w in writes)
+
+
+def plan(chip, assume_reset=True):
+    # Returns (writes, accesses, rmw_accesses) for every configured port of
+    # the chip, where rmw_accesses is the cost of the plain read-modify-write
+    # sequence that chip.serialize_settings() describes.
+    writes   = []
+    baseline = 0
+    for port in chip.gpio_ports():
+        state = chip.ports.get(port)
+        if state is None:
+            continue
+        reset     = chip_db.get_gpio_reset_words(chip.part, port)
+        writes   += plan_port(state, reset, assume_reset)
+        baseline += rmw_accesses(state)
+    return writes, accesses(writes), baseline
@@ -0,0 +1,306 @@
+import json
+import os
+import stat
+import struct
+import tempfile
+
+from . import chip_db
+from . import chip_stm
+from . import gpio_regs
+from . import init_seq
+
+
+def _file_mode(path):
+    # The mode a plain open() would leave path with: that of the existing
+    # file, or 0666 less the umask for a new one.
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def atomic_write(path, write, binary=False):
+    # Calls write(f) on a temporary file next to path and renames it into
+    # place, so readers of path see either the old or the new contents, never
+    # a partially-written file.  mkstemp() creates the file private to the
+    # user, so it is given path's usual mode first.
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.stm_layout-')
+    try:
+        if binary:
+            f = os.fdopen(fd, 'wb')
+        else:
+            f = os.fdopen(fd, 'w', encoding='utf8')
+        with f:
+            write(f)
+        os.chmod(tmp, _file_mode(path))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def configured_ports(chip):
+    # The PortStates that have at least one configured pin, in port order.
+    ports = []
+    for p in chip.gpio_ports():
+        state = chip.ports.get(p)
+        if state is not None and state.touched:
+            ports.append(state)
+    return ports
+
+
+# Backends stream one chip's configuration to a file object: begin() once,
+# write_port() for every configured port and end() once.  A backend instance
+# may keep state between writes of the same chip; TextBackend uses that to
+# re-render only ports whose PortState version changed.
+class TextBackend:
+    binary    = False
+    extension = '.txt'
+
+    def __init__(self):
+        self._cache = {}
+
+    def begin(self, f, chip, nports):
+        pass
+
+    def write_port(self, f, state):
+        cached = self._cache.get(state.name)
+        if cached is None or cached[0] != state.version:
+            cached = (state.version, chip_stm.format_port(state))
+            self._cache[state.name] = cached
+        f.write(cached[1])
+
+    def end(self, f):
+        pass
+
+
+class CBackend:
+    binary    = False
+    extension = '.h'
+
+    def begin(self, f, chip, nports):
+        f.write('/* GPIO configuration for %s.  For each port:\n'
+                ' *     reg = (reg & keep[i]) | set[i]\n'
+                ' * with registers in %s order. */\n' % (
+                    chip.name, ', '.join(gpio_regs.REGISTERS)))
+        f.write('#include <stdint.h>\n\n')
+        f.write('typedef struct {\n'
+                '    GPIO_TypeDef *port;\n'
+                '    uint32_t      keep[6];\n'
+                '    uint32_t      set[6];\n'
+                '} stm_layout_gpio_init_t;\n\n')
+        f.write('#define STM_LAYOUT_GPIO_INIT_N %u\n\n' % nports)
+        f.write('static const stm_layout_gpio_init_t '
+                'stm_layout_gpio_init[] = {\n')
+
+    def write_port(self, f, state):
+        regs = state.registers()
+        f.write('    {GPIO%s,\n' % state.name[1:])
+        f.write('     {%s},\n' % ', '.join('0x%08X' % k for _, k, _ in regs))
+        f.write('     {%s}},\n' % ', '.join('0x%08X' % v for _, _, v in regs))
+
+    def end(self, f):
+        f.write('};\n')
+
+
+class RustBackend:
+    binary    = False
+    extension = '.rs'
+
+    def begin(self, f, chip, nports):
+        f.write('// GPIO configuration for %s.  For each port:\n'
+                '//     reg = (reg & keep[i]) | set[i]\n'
+                '// with registers in %s order.\n' % (
+                    chip.name, ', '.join(gpio_regs.REGISTERS)))
+        f.write('pub struct GpioInit {\n'
+                '    pub port: u8,\n'
+                '    pub keep: [u32; 6],\n'
+                '    pub set: [u32; 6],\n'
+                '}\n\n')
+        f.write('pub const GPIO_INIT: [GpioInit; %u] = [\n' % nports)
+
+    def write_port(self, f, state):
+        regs = state.registers()
+        f.write('    GpioInit {\n')
+        f.write("        port: b'%s',\n" % state.name[1:])
+        f.write('        keep: [%s],\n' %
+                ', '.join('0x%08X' % k for _, k, _ in regs))
+        f.write('        set: [%s],\n' %
+                ', '.join('0x%08X' % v for _, _, v in regs))
+        f.write('    },\n')
+
+    def end(self, f):
+        f.write('];\n')
+
+
+class JSONBackend:
+    binary    = False
+    extension = '.json'
+
+    def __init__(self):
+        self._first = True
+
+    def begin(self, f, chip, _nports):
+        f.write('{"part":%s,"ports":[' % json.dumps(chip.part.partname))
+        self._first = True
+
+    def write_port(self, f, state):
+        if not self._first:
+            f.write(',')
+        self._first = False
+        json.dump({'port'      : state.name,
+                   'touched'   : state.touched,
+                   'registers' : {r : {'keep' : k, 'set' : v}
+                                  for r, k, v in state.registers()}},
+                  f, separators=(',', ':'))
+
+    def end(self, f):
+        f.write(']}\n')
+
+
+class BinaryBackend:
+    # Header: magic, format version, port count.  Then one record per port:
+    # port letter, touched-pin mask and a (keep, set) pair for each register
+    # in gpio_regs.REGISTERS order, all little-endian.
+    binary    = True
+    extension = '.bin'
+    MAGIC     = b'STML'
+    VERSION   = 1
+    HEADER    = struct.Struct('<4sBB')
+    RECORD    = struct.Struct('<cxH12I')
+
+    def begin(self, f, _chip, nports):
+        f.write(self.HEADER.pack(self.MAGIC, self.VERSION, nports))
+
+    def write_port(self, f, state):
+        values = []
+        for _, k, v in state.registers():
+            values += [k, v]
+        f.write(self.RECORD.pack(state.name[1:].encode(), state.touched,
+                                 *values))
+
+    def end(self, f):
+        pass
+
+
+class InitBackend:
+    # A table-driven C init routine built from init_seq.plan_port(), with the
+    # register accesses it saves over the read-modify-write sequence noted
+    # at the end of the file (and kept in .accesses and .rmw_accesses).
+    binary       = False
+    extension    = '.c'
+    assume_reset = True
+    CMSIS_NAMES  = {'AFRL' : 'AFR[0]', 'AFRH' : 'AFR[1]'}
+
+    def __init__(self):
+        self.part         = None
+        self.accesses     = 0
+        self.rmw_accesses = 0
+
+    def begin(self, f, chip, _nports):
+        self.part         = chip.part
+        self.accesses     = 0
+        self.rmw_accesses = 0
+        f.write('/* GPIO init sequence for %s. */\n' % chip.name)
+        if self.assume_reset:
+            f.write('/* Assumes the GPIO registers still hold their reset '
+                    'values. */\n')
+        f.write('#include <stdint.h>\n\n')
+        f.write('typedef struct {\n'
+                '    volatile uint32_t *reg;\n'
+                '    uint32_t           keep; /* 0: plain write */\n'
+                '    uint32_t           set;\n'
+                '} stm_layout_gpio_write_t;\n\n')
+        f.write('static const stm_layout_gpio_write_t '
+                'stm_layout_gpio_writes[] = {\n')
+
+    def write_port(self, f, state):
+        reset  = chip_db.get_gpio_reset_words(self.part, state.name)
+        writes = init_seq.plan_port(state, reset, self.assume_reset)
+        for w in writes:
+            f.write('    {&GPIO%s->%s, 0x%08X, 0x%08X},\n' % (
+                w.port[1:], self.CMSIS_NAMES.get(w.register, w.register),
+                w.keep, w.value))
+        self.accesses     += init_seq.accesses(writes)
+        self.rmw_accesses += init_seq.rmw_accesses(state)
+
+    def end(self, f):
+        f.write('    {0, 0, 0},\n'
+                '};\n\n'
+                'static inline void stm_layout_gpio_init(void)\n'
+                '{\n'
+                '    const stm_layout_gpio_write_t *w;\n'
+                '    for (w = stm_layout_gpio_writes; w->reg; ++w)\n'
+                '        *w->reg = w->keep ? (*w->reg & w->keep) | w->set '
+                ': w->set;\n'
+                '}\n\n')
+        f.write('/* %u register accesses, %u saved over read-modify-write '
+                'of every\n * register (%u accesses). */\n' % (
+                    self.accesses, self.rmw_accesses - self.accesses,
+                    self.rmw_accesses))
+
+
+class InitRMWBackend(InitBackend):
+    # For code that may run after the GPIOs were already touched, e.g. by a
+    # bootloader.
+    assume_reset = False
+
+
+BACKENDS = {
+    'text'     : TextBackend,
+    'c'        : CBackend,
+    'rust'     : RustBackend,
+    'json'     : JSONBackend,
+    'binary'   : BinaryBackend,
+    'init'     : InitBackend,
+    'init-rmw' : InitRMWBackend,
+}
+
+
+def write_chip(chip, f, backend):
+    ports = configured_ports(chip)
+    backend.begin(f, chip, len(ports))
+    for state in ports:
+        backend.write_port(f, state)
+    backend.end(f)
+
+
+def write_file(chip, path, fmt='text'):
+    backend = BACKENDS[fmt]()
+    atomic_write(path, lambda f: write_chip(chip, f, backend),
+                 binary=backend.binary)
+    return backend
+
+
+class PinoutWriter:
+    # Writes the chip's configuration to path through one of the BACKENDS,
+    # skipping the write entirely when no PortState version changed since the
+    # last one.
+    def __init__(self, chip, path, fmt='text'):
+        self.chip     = chip
+        self.path     = path
+        self.backend  = BACKENDS[fmt]()
+        self._ports   = [chip.ports[p]
+                         for p in chip.gpio_ports()
+                         if p in chip.ports]
+        self._written = self._versions()
+
+    def _versions(self):
+        return tuple(state.version for state in self._ports)
+
+    def dirty(self):
+        return self._versions() != self._written
+
+    def write(self, force=False):
+        # Returns True if the file was written.
+        if not force and not self.dirty():
+            return False
+        versions = self._versions()
+        atomic_write(self.path,
+                     lambda f: write_chip(self.chip, f, self.backend),
+                     binary=self.backend.binary)
+        self._written = versions
+        return True
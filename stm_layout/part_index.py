@@ -0,0 +1,59 @@
+import bisect
+
+
+# Partname index supporting prefix and substring queries.  Partnames are kept
+# in a sorted array for prefix queries and every suffix of every partname is
+# kept in a second sorted array (a simple suffix array), so a substring query
+# is a bisect to the first suffix starting with the query followed by a scan
+# over just the matches.
+class PartIndex:
+    def __init__(self):
+        self.parts     = {}
+        self._names    = []
+        self._suffixes = []
+
+    def __len__(self):
+        return len(self.parts)
+
+    def __contains__(self, partname):
+        return partname in self.parts
+
+    def get(self, partname, default=None):
+        return self.parts.get(partname, default)
+
+    def update(self, parts):
+        new_names = []
+        for part in parts:
+            if part.partname not in self.parts:
+                new_names.append(part.partname)
+            self.parts[part.partname] = part
+        if not new_names:
+            return
+
+        # Rebuilding with one sort per batch is much cheaper than an insort
+        # per suffix when a whole family arrives at once.
+        self._names.extend(new_names)
+        self._names.sort()
+        self._suffixes.extend((name[i:], name)
+                              for name in new_names
+                              for i in range(len(name)))
+        self._suffixes.sort()
+
+    def prefixed(self, prefix):
+        i     = bisect.bisect_left(self._names, prefix)
+        parts = []
+        while i < len(self._names) and self._names[i].startswith(prefix):
+            parts.append(self.parts[self._names[i]])
+            i += 1
+        return parts
+
+    def search(self, s):
+        if not s:
+            return [self.parts[name] for name in self._names]
+
+        i     = bisect.bisect_left(self._suffixes, (s,))
+        names = set()
+        while i < len(self._suffixes) and self._suffixes[i][0].startswith(s):
+            names.add(self._suffixes[i][1])
+            i += 1
+        return [self.parts[name] for name in sorted(names)]
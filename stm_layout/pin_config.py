@@ -0,0 +1,279 @@
+import collections
+import csv
+import json
+import os
+
+from . import chip_stm
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+# A pin configuration maps GPIO names to settings:
+#
+#   {"part" : "stm32g474cet6",
+#    "pins" : {"PA9"  : {"signal" : "USART1_TX", "speed" : "High"},
+#              "PA10" : {"af" : 7, "resistor" : "Pull-Up"},
+#              "PB0"  : {"mode" : "Analog"}}}
+#
+# "part" is optional.  Choices are given by label (case-insensitive) or by
+# index.  "af" or "signal" select an alternate function, which implies the
+# Alternate mode.  CSV files hold one pin per row with a header naming the
+# columns pin, mode, speed, type, resistor, af and signal; empty cells are
+# left unset.
+CHOICE_FIELDS = ('mode', 'speed', 'type', 'resistor')
+FIELDS        = ('pin',) + CHOICE_FIELDS + ('af', 'signal')
+
+# Offsets of each choice group in the flat index used by GPIO._set_choice().
+CHOICE_OFFSETS = (0,
+                  len(chip_stm.MODE_CHOICES),
+                  len(chip_stm.MODE_CHOICES) + len(chip_stm.SPEED_CHOICES),
+                  len(chip_stm.MODE_CHOICES) + len(chip_stm.SPEED_CHOICES) +
+                  len(chip_stm.TYPE_CHOICES))
+
+# A validated entry: the GPIOs it applies to (a name can be bonded to more
+# than one package pin), the choice value for each of CHOICE_FIELDS (or
+# None) and the alternate function (or None).
+PinSetting = collections.namedtuple('PinSetting',
+                                    ['name', 'pins', 'choices', 'af'])
+
+# Problem kinds.  pin is None for problems that aren't about one pin.
+UNKNOWN_PIN      = 'unknown-pin'
+BAD_VALUE        = 'bad-value'
+NO_FUNCTION      = 'no-function'
+DISABLED_CHOICE  = 'disabled-choice'
+DUPLICATE_SIGNAL = 'duplicate-signal'
+UNKNOWN_PART     = 'unknown-part'
+BAD_FILE         = 'bad-file'
+
+Problem = collections.namedtuple('Problem', ['kind', 'pin', 'message'])
+
+# Errors the loaders raise for malformed files; load_config() reports them
+# all as ValueError.
+PARSE_ERRORS = (ValueError, csv.Error)
+if yaml is not None:
+    PARSE_ERRORS += (yaml.YAMLError,)
+
+
+def _load_json(f):
+    return json.load(f)
+
+
+def _load_yaml(f):
+    if yaml is None:
+        raise ValueError('YAML configs need PyYAML (pip3 install pyyaml)')
+    return yaml.safe_load(f)
+
+
+def _load_csv(f):
+    pins = {}
+    for row in csv.DictReader(f):
+        row  = {k.strip().lower(): v.strip() for k, v in row.items()
+                if k is not None and v}
+        name = row.pop('pin', None)
+        if name is None:
+            raise ValueError('CSV row without a pin: %s' % row)
+        pins[name] = row
+    return {'pins' : pins}
+
+
+LOADERS = {
+    '.json' : _load_json,
+    '.yaml' : _load_yaml,
+    '.yml'  : _load_yaml,
+    '.csv'  : _load_csv,
+}
+
+
+def load_config(path):
+    # Returns (partname or None, {pin name: {field: value}}).
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in LOADERS:
+        raise ValueError('%s: unknown config type "%s"' % (path, ext))
+    with open(path, encoding='utf8', newline='') as f:
+        try:
+            config = LOADERS[ext](f)
+        except PARSE_ERRORS as e:
+            raise ValueError('%s: %s' % (path, e)) from e
+    if not isinstance(config, dict) or not isinstance(config.get('pins'),
+                                                      dict):
+        raise ValueError('%s: expected a mapping with a "pins" mapping' % path)
+    part = config.get('part')
+    if part is not None and not isinstance(part, str):
+        raise ValueError('%s: "part" must be a part name' % path)
+    return part, config['pins']
+
+
+def _check_scalar(value, what=''):
+    # Settings are labels or numbers; lists, mappings, booleans and nulls
+    # from JSON or YAML would otherwise get as far as int().
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        raise ValueError('%s%s is not a label or a number' % (
+            what, json.dumps(value, default=str)))
+
+
+def _parse_choice(labels, value):
+    _check_scalar(value)
+    if isinstance(value, str) and not value.isdigit():
+        for i, label in enumerate(labels):
+            if label.lower() == value.lower():
+                return i
+        raise ValueError('"%s" is not one of %s' % (value, ', '.join(labels)))
+    i = int(value)
+    if not 0 <= i < len(labels):
+        raise ValueError('%u is out of range' % i)
+    return i
+
+
+def _parse_af(value):
+    _check_scalar(value, 'af ')
+    if isinstance(value, str) and value.upper().startswith('AF'):
+        value = value[2:]
+    af = int(value)
+    if not 0 <= af < 16:
+        raise ValueError('AF%u is out of range' % af)
+    return af
+
+
+def gpio_names(chip):
+    names = collections.defaultdict(list)
+    for p in chip.pins.values():
+        if p._choices:
+            names[p.name].append(p)
+    return names
+
+
+def resolve(chip, pins):
+    # Validates every entry of a config's pins mapping against the chip in
+    # one pass and returns ([PinSetting], [Problem]).  Everything is checked
+    # before anything is applied.
+    names    = gpio_names(chip)
+    settings = []
+    problems = []
+    signals  = collections.defaultdict(list)
+    for name, fields in pins.items():
+        gpios = names.get(name)
+        if gpios is None:
+            problems.append(Problem(UNKNOWN_PIN, name, 'unknown pin'))
+            continue
+        if not isinstance(fields, dict):
+            problems.append(Problem(BAD_VALUE, name,
+                                    'expected a mapping of settings'))
+            continue
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            problems.append(Problem(BAD_VALUE, name, 'unknown settings %s' %
+                                    ', '.join(sorted(map(str, unknown)))))
+
+        choices = {}
+        for field, choice in zip(CHOICE_FIELDS, gpios[0]._choices):
+            if fields.get(field) is None:
+                continue
+            try:
+                choices[field] = _parse_choice(choice.choices, fields[field])
+            except ValueError as e:
+                problems.append(Problem(BAD_VALUE, name,
+                                        '%s %s' % (field, e)))
+
+        af     = None
+        signal = fields.get('signal')
+        alts   = gpios[0].alt_fns
+        if signal is not None and not isinstance(signal, str):
+            problems.append(Problem(BAD_VALUE, name,
+                                    'signal %s is not a name' %
+                                    json.dumps(signal, default=str)))
+            signal = None
+        if fields.get('af') is not None:
+            try:
+                af = _parse_af(fields['af'])
+            except ValueError as e:
+                problems.append(Problem(BAD_VALUE, name, str(e)))
+            else:
+                if af >= len(alts) or alts[af] == '-':
+                    problems.append(Problem(NO_FUNCTION, name,
+                                            'AF%u has no function' % af))
+                elif signal is None and '/' not in alts[af]:
+                    signal = alts[af]
+        if isinstance(fields.get('signal'), str):
+            matches = [i for i, f in enumerate(alts)
+                       if signal in f.split('/')]
+            if not matches:
+                problems.append(Problem(NO_FUNCTION, name,
+                                        'no alternate function provides %s' %
+                                        signal))
+            elif af is not None and af not in matches:
+                problems.append(Problem(NO_FUNCTION, name,
+                                        'AF%u does not provide %s' % (
+                                            af, signal)))
+            else:
+                af = matches[0] if af is None else af
+        mode = choices.get('mode')
+        if af is not None:
+            if mode is not None and mode != 2:
+                problems.append(Problem(DISABLED_CHOICE, name,
+                                        'an alternate function needs the '
+                                        'Alternate mode, not %s' %
+                                        chip_stm.MODE_CHOICES[mode]))
+            if signal is not None:
+                signals[signal].append(name)
+
+        settings.append(PinSetting(name, gpios,
+                                   tuple(choices.get(f) for f in CHOICE_FIELDS),
+                                   af))
+
+    for signal, owners in signals.items():
+        if len(owners) > 1:
+            problems.append(Problem(DUPLICATE_SIGNAL, None,
+                                    '%s assigned to %s' % (
+                                        signal, ', '.join(owners))))
+    return settings, problems
+
+
+def apply_settings(settings):
+    # Applies resolved settings through the GPIO state methods, which enforce
+    # the same enable rules as the UI.  Returns a problem for every requested
+    # choice that those rules left disabled (e.g. a speed on an input).
+    problems = []
+    for s in settings:
+        for pin in s.pins:
+            if s.af is not None:
+                pin._set_altfn(s.af)
+            elif s.choices[0] is not None and pin._altfn is not None:
+                pin._clear_altfn()
+            for val, offset in zip(s.choices, CHOICE_OFFSETS):
+                if val is not None:
+                    pin._set_choice(offset + val)
+
+        mode = s.pins[0]._choices[0]
+        for field, val, choice in zip(CHOICE_FIELDS, s.choices,
+                                      s.pins[0]._choices):
+            if val is not None and choice.val != val:
+                problems.append(Problem(DISABLED_CHOICE, s.name,
+                                        '%s %s is disabled in mode %s' % (
+                                            field, choice.choices[val],
+                                            mode.choices[mode.val])))
+    return problems
+
+
+def apply_config(chip, pins):
+    # Resolves and applies a config's pins mapping.  Returns the list of
+    # problems; the chip is only modified if resolving found none.
+    settings, problems = resolve(chip, pins)
+    if problems:
+        return problems
+    return apply_settings(settings)
+
+
+def check_config(chip, pins):
+    # Like apply_config(), but also applies whatever resolved cleanly so that
+    # disabled choices are found even in configs with other problems.
+    settings, problems = resolve(chip, pins)
+    return problems + apply_settings(settings)
+
+
+def format_problem(p):
+    if p.pin is None:
+        return p.message
+    return '%s: %s' % (p.pin, p.message)
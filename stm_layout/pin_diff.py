@@ -0,0 +1,64 @@
+import collections
+import re
+
+
+PinDelta = collections.namedtuple('PinDelta',
+                                  ['key', 'old_name', 'new_name',
+                                   'lost_alt_fns', 'gained_alt_fns',
+                                   'lost_add_fns', 'gained_add_fns'])
+
+
+def _key_order(key):
+    # Sorts '2' before '10' and 'A2' before 'A10' instead of lexically.
+    return [(0, int(t), '') if t.isdigit() else (1, 0, t)
+            for t in re.findall(r'\d+|\D+', key)]
+
+
+def _alt_fn_set(pin):
+    if pin is None:
+        return set()
+    return {(af, s) for af, f in enumerate(pin.alt_fns)
+            for s in f.split('/') if s != '-'}
+
+
+def diff_chips(chip_a, chip_b):
+    # Returns a PinDelta for every pin position whose name, alternate
+    # functions or additional functions differ between the two chips.  Pins
+    # with equal signatures are skipped without looking at their contents.
+    sigs_a = chip_a.pin_signatures()
+    sigs_b = chip_b.pin_signatures()
+    deltas = []
+    for key in sorted(sigs_a.keys() | sigs_b.keys(), key=_key_order):
+        sig_a = sigs_a.get(key)
+        if sig_a is not None and sig_a == sigs_b.get(key):
+            continue
+
+        pa     = chip_a.pins.get(key)
+        pb     = chip_b.pins.get(key)
+        alts_a = _alt_fn_set(pa)
+        alts_b = _alt_fn_set(pb)
+        adds_a = set(pa.add_fns) if pa else set()
+        adds_b = set(pb.add_fns) if pb else set()
+        d      = PinDelta(key,
+                          pa.full_name if pa else None,
+                          pb.full_name if pb else None,
+                          sorted(alts_a - alts_b),
+                          sorted(alts_b - alts_a),
+                          sorted(adds_a - adds_b),
+                          sorted(adds_b - adds_a))
+
+        # Every delta reported must list a change, whatever the signatures
+        # said.
+        if d.old_name != d.new_name or any(d[3:]):
+            deltas.append(d)
+    return deltas
+
+
+def format_delta(d):
+    changes = []
+    changes += ['-AF%u:%s' % af for af in d.lost_alt_fns]
+    changes += ['+AF%u:%s' % af for af in d.gained_alt_fns]
+    changes += ['-%s' % f for f in d.lost_add_fns]
+    changes += ['+%s' % f for f in d.gained_add_fns]
+    return '%-6s %-20s %-20s %s' % (d.key, d.old_name or '(none)',
+                                    d.new_name or '(none)', ' '.join(changes))
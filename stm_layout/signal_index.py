@@ -0,0 +1,120 @@
+import collections
+import fnmatch
+import json
+import os
+
+import modm_devices.parser
+
+from . import chip_db
+from . import chip_stm
+
+
+# Bump whenever the layout of a cached file entry changes.
+SIGNAL_INDEX_VERSION = 2
+SIGNAL_INDEX_FILE    = os.path.join(chip_db.CACHE_DIR, 'signal_index.json')
+
+# Parts sharing a die and package almost always share a pinout, so the index
+# stores each distinct pinout once and maps signals to (pinout, pin, AF)
+# entries; PINOUTS maps a pinout back to the parts that use it.  Additional
+# (analog) functions are indexed with an AF of None.  SKIPPED holds the
+# parts whose pin data couldn't be read, so aren't in the index.
+SIGNALS         = collections.defaultdict(list)
+PINOUTS         = []
+SKIPPED         = set()
+LOADED_PREFIXES = set()
+
+Hit = collections.namedtuple('Hit',
+                             ['signal', 'partname', 'package', 'key', 'af'])
+
+
+def _pinout_signals(pins):
+    signals = collections.defaultdict(list)
+    for key, p in pins.items():
+        for af, f in enumerate(p.alt_fns):
+            for s in f.split('/'):
+                if s != '-':
+                    signals[s].append([key, af])
+        for f in p.add_fns:
+            signals[f].append([key, None])
+    return signals
+
+
+def _index_file(filename):
+    parser  = modm_devices.parser.DeviceParser()
+    devfile = parser.parse(filename)
+    pinouts = []
+    parts   = []
+    skipped = []
+    seen    = {}
+    for device in devfile.get_devices():
+        try:
+            signals = _pinout_signals(chip_stm.make_pins(device))
+            package = chip_db.package(device)
+        except KeyError:
+            skipped.append(device.partname)
+            continue
+
+        signature = json.dumps(signals, sort_keys=True)
+        if signature not in seen:
+            seen[signature] = len(pinouts)
+            pinouts.append(signals)
+        parts.append([device.partname, package, seen[signature]])
+    return {'pinouts' : pinouts, 'parts' : parts, 'skipped' : skipped}
+
+
+def build(prefix='', jobs=1):
+    # As with chip_db.find(), only the family part of the prefix can be used
+    # to select device files.
+    prefix = prefix[:7]
+    if any(prefix.startswith(p) for p in LOADED_PREFIXES):
+        return
+
+    cache        = chip_db.load_cache(SIGNAL_INDEX_FILE, SIGNAL_INDEX_VERSION)
+    files, dirty = chip_db.refresh_cache(cache, prefix, _index_file, jobs)
+    if dirty:
+        chip_db.save_cache(SIGNAL_INDEX_FILE, cache)
+
+    # Files already merged by a shorter or sibling prefix are skipped so
+    # that overlapping builds never duplicate hits.
+    loaded = {p for pinout_parts in PINOUTS for p, _ in pinout_parts}
+    for _, data in files:
+        SKIPPED.update(data['skipped'])
+        base = len(PINOUTS)
+        for _ in data['pinouts']:
+            PINOUTS.append([])
+        for partname, package, i in data['parts']:
+            if partname not in loaded:
+                PINOUTS[base + i].append((partname, package))
+        for i, signals in enumerate(data['pinouts']):
+            if not PINOUTS[base + i]:
+                continue
+            for s, pins in signals.items():
+                SIGNALS[s].extend((base + i, key, af) for key, af in pins)
+    LOADED_PREFIXES.add(prefix)
+
+
+def skipped_parts(prefix='', jobs=1):
+    # The parts matching prefix that are missing from the index.
+    build(prefix, jobs)
+    return sorted(p for p in SKIPPED if p.startswith(prefix))
+
+
+def lookup(signal, af=None, prefix='', jobs=1):
+    # signal may be an exact name (USART3_TX) or a shell-style pattern
+    # (USART*_TX).  Hits are returned sorted by partname and pin.
+    build(prefix, jobs)
+    if any(c in signal for c in '*?['):
+        names = fnmatch.filter(SIGNALS.keys(), signal.upper())
+    else:
+        names = [signal.upper()] if signal.upper() in SIGNALS else []
+
+    hits = []
+    for name in names:
+        for pinout, key, pin_af in SIGNALS[name]:
+            if af is not None and pin_af != af:
+                continue
+            for partname, package in PINOUTS[pinout]:
+                if partname.startswith(prefix):
+                    hits.append(Hit(name, partname, package, key, pin_af))
+    hits.sort(key=lambda h: (h.partname, h.signal, h.key))
+    return hits
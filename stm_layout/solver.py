@@ -0,0 +1,340 @@
+import collections
+import fnmatch
+import re
+import time
+
+
+# Signal roles used when a request names a peripheral without listing them.
+PRESETS = {
+    'SPI'     : ('SCK', 'MISO', 'MOSI'),
+    'I2C'     : ('SCL', 'SDA'),
+    'USART'   : ('TX', 'RX'),
+    'UART'    : ('TX', 'RX'),
+    'LPUART'  : ('TX', 'RX'),
+    'FDCAN'   : ('TX', 'RX'),
+    'CAN'     : ('TX', 'RX'),
+    'QUADSPI' : ('CLK', 'BK1_NCS', 'BK1_IO0', 'BK1_IO1', 'BK1_IO2',
+                 'BK1_IO3'),
+    'SDMMC'   : ('CK', 'CMD', 'D0', 'D1', 'D2', 'D3'),
+}
+
+# A requested group of signals that must all come from one peripheral
+# instance; instances lists the instances that could provide them.
+Group = collections.namedtuple('Group', ['spec', 'instances', 'roles'])
+
+# assignment maps each signal to (pin name, af).  optimal is False if the
+# time budget ran out before the search space was exhausted.
+Solution = collections.namedtuple('Solution',
+                                  ['assignment', 'instances', 'cost',
+                                   'optimal', 'elapsed'])
+
+
+class Timeout(Exception):
+    # Raised when the time budget runs out before any assignment was found.
+    pass
+
+
+def _split_signal(signal):
+    # 'USART1_TX' -> ('USART1', 'TX'), 'QUADSPI_BK1_IO0' -> ('QUADSPI',
+    # 'BK1_IO0').
+    instance, _, role = signal.partition('_')
+    return instance, role
+
+
+def _peripheral(instance):
+    return re.sub(r'\d+$', '', instance)
+
+
+def parse_request(spec, signal_pins):
+    # Returns the Groups for one wish-list entry.  Entries look like:
+    #
+    #   USART1_TX           a single signal
+    #   USART1:TX,RX        the listed roles of one instance
+    #   SPI2                the PRESETS roles of one instance
+    #   USART               the PRESETS roles of any USART instance
+    #   SPI*:SCK,MOSI       the listed roles of any instance matching SPI*
+    #   2*I2C               two distinct instances
+    count = 1
+    m     = re.match(r'^(\d+)\s*[*x]\s*(.+)$', spec)
+    if m:
+        count, spec = int(m.group(1)), m.group(2)
+
+    if ':' in spec:
+        pattern, roles = spec.split(':', 1)
+        roles = tuple(r.strip().upper() for r in roles.split(','))
+    elif spec.upper() in signal_pins:
+        pattern, role = _split_signal(spec.upper())
+        roles = (role,)
+    else:
+        pattern = spec
+        roles   = PRESETS.get(_peripheral(spec.upper().rstrip('*?')))
+        if roles is None:
+            raise ValueError('"%s": no default signals for this peripheral; '
+                             'list them as %s:ROLE,...' % (spec, spec))
+    pattern = pattern.strip().upper()
+
+    available = {_split_signal(s)[0] for s in signal_pins}
+    instances = sorted(i for i in available
+                       if (fnmatch.fnmatchcase(i, pattern) or
+                           _peripheral(i) == pattern) and
+                       all('%s_%s' % (i, r) in signal_pins for r in roles))
+    if not instances:
+        raise ValueError('"%s": no instance on this part provides %s' % (
+            spec, ', '.join(roles)))
+    return [Group(spec, instances, roles)] * count
+
+
+def _bfs(match_r, adj, free):
+    dist  = {}
+    queue = collections.deque()
+    for u in free:
+        dist[u] = 0
+        queue.append(u)
+    found = False
+    while queue:
+        u = queue.popleft()
+        for v in adj[u]:
+            w = match_r.get(v)
+            if w is None:
+                found = True
+            elif w not in dist:
+                dist[w] = dist[u] + 1
+                queue.append(w)
+    return found, dist
+
+
+def _dfs(u, match_l, match_r, adj, dist):
+    for v in adj[u]:
+        w = match_r.get(v)
+        if w is None or (dist.get(w) == dist[u] + 1 and
+                         _dfs(w, match_l, match_r, adj, dist)):
+            match_l[u] = v
+            match_r[v] = u
+            return True
+    dist[u] = None
+    return False
+
+
+def hopcroft_karp(left, adj, match_l=None):
+    # Maximum bipartite matching of the left vertices onto the vertices in
+    # their adj lists.  An existing matching may be passed in to be extended;
+    # it is copied, not modified.  Returns the {left: right} matching.
+    match_l = dict(match_l or {})
+    match_r = {v: u for u, v in match_l.items()}
+    while True:
+        free = [u for u in left if u not in match_l]
+        found, dist = _bfs(match_r, adj, free)
+        if not found:
+            return match_l
+        augmented = False
+        for u in free:
+            if _dfs(u, match_l, match_r, adj, dist):
+                augmented = True
+        if not augmented:
+            return match_l
+
+
+def min_cost_matching(left, adj, cost):
+    # Perfect matching of left minimizing the sum of cost[right], by
+    # successive shortest augmenting paths (Bellman-Ford, as the residual
+    # graph has negative edges).  Returns None if no perfect matching exists.
+    match_l = {}
+    match_r = {}
+    for s in left:
+        dist = {s: 0}
+        prev = {}
+        best = None
+        todo = collections.deque([s])
+        while todo:
+            u = todo.popleft()
+            for v in adj[u]:
+                if match_l.get(u) == v:
+                    continue
+                d = dist[u] + cost[v]
+                if d >= dist.get(v, float('inf')):
+                    continue
+                dist[v] = d
+                prev[v] = u
+                w = match_r.get(v)
+                if w is None:
+                    if best is None or d < dist[best]:
+                        best = v
+                else:
+                    d -= cost[v]
+                    if d < dist.get(w, float('inf')):
+                        dist[w] = d
+                        todo.append(w)
+        if best is None:
+            return None
+        v = best
+        while True:
+            u = prev[v]
+            w = match_l.get(u)
+            match_l[u] = v
+            match_r[v] = u
+            if u == s:
+                break
+            v = w
+    return match_l
+
+
+class Solver:
+    # Finds a conflict-free pin for every requested signal.  Groups whose
+    # instance is fixed only need a bipartite matching of signals onto pins;
+    # groups with a choice of instances are searched with backtracking, most
+    # constrained group first, checking each partial choice by extending the
+    # current Hopcroft-Karp matching.  With a preference score the search
+    # continues after the first solution, keeping the cheapest (by
+    # min-cost matching) and pruning branches whose lower bound can't beat it.
+    def __init__(self, chip, groups, fixed=None, score=None):
+        self.chip   = chip
+        self.groups = groups
+        self.fixed  = dict(fixed or {})
+        self.score  = dict(score) if score is not None else None
+
+        # {signal: {pin name: af}} over the GPIOs that aren't fixed.  A name
+        # bonded to several package pins is one pad, so keys collapse.
+        self.options = collections.defaultdict(dict)
+        for s, pins in chip.signal_pins().items():
+            for p, af in pins:
+                if p._choices and p.name not in self.fixed:
+                    self.options[s].setdefault(p.name, af)
+        self.adj = {s: sorted(pins) for s, pins in self.options.items()}
+
+        # {signal: (pin name, af)} for the fixed pins.
+        self.fixed_signals = {}
+        for name, s in self.fixed.items():
+            for p, af in chip.signal_pins().get(s, ()):
+                if p.name == name:
+                    self.fixed_signals[s] = (name, af)
+                    break
+
+        self.best      = None
+        self.deadline  = None
+        self.exhausted = True
+
+    def _signals(self, group, instance):
+        return ['%s_%s' % (instance, r) for r in group.roles]
+
+    def _order(self):
+        # Fixed-instance groups first, then by fewest candidate instances.
+        return sorted(self.groups, key=lambda g: len(g.instances))
+
+    def _min_score(self, signal):
+        if signal in self.fixed_signals:
+            return 0
+        if signal not in self.adj:
+            return float('inf')
+        return min(self.score[p] for p in self.adj[signal])
+
+    def _lower_bound(self, groups):
+        return sum(min(sum(self._min_score(s)
+                           for s in self._signals(g, i))
+                       for i in g.instances)
+                   for g in groups)
+
+    def _record(self, chosen, match, instances):
+        signals = [s for s in chosen if s not in self.fixed_signals]
+        if self.score is None:
+            cost = 0
+        else:
+            match = min_cost_matching(signals, self.adj, self.score)
+            cost  = sum(self.score[p] for p in match.values())
+        if self.best is None or cost < self.best[0]:
+            assignment = dict(self.fixed_signals)
+            for s, p in match.items():
+                assignment[s] = (p, self.options[s][p])
+            self.best = (cost, assignment, list(instances))
+
+    def _search(self, groups, i, chosen, match, chosen_instances):
+        if time.perf_counter() > self.deadline:
+            raise Timeout()
+        if i == len(groups):
+            self._record(chosen, match, chosen_instances)
+            return self.score is None
+
+        # Repeated groups ("2*USART") are interchangeable, so their instances
+        # are only tried in increasing order.
+        g         = groups[i]
+        instances = g.instances
+        if i and groups[i - 1] is g:
+            instances = instances[instances.index(chosen_instances[-1][1]) + 1:]
+        for inst in instances:
+            signals = self._signals(g, inst)
+            if any(s in chosen for s in signals):
+                continue
+            if any(s not in self.adj and s not in self.fixed_signals
+                   for s in signals):
+                continue
+            new = [s for s in signals if s not in self.fixed_signals]
+            m   = hopcroft_karp(list(match) + new, self.adj, match)
+            if len(m) < len(match) + len(new):
+                continue
+
+            if self.score is not None and self.best is not None:
+                bound = (sum(self._min_score(s) for s in chosen) +
+                         sum(self._min_score(s) for s in signals) +
+                         self._lower_bound(groups[i + 1:]))
+                if bound >= self.best[0]:
+                    continue
+
+            if self._search(groups, i + 1, chosen | set(signals), m,
+                            chosen_instances + [(g.spec, inst)]):
+                return True
+        return False
+
+    def solve(self, budget=10.):
+        # Returns None if there is no assignment, or raises Timeout if the
+        # budget ran out before one was found.
+        t0             = time.perf_counter()
+        self.deadline  = t0 + budget
+        self.best      = None
+        self.exhausted = True
+        if self.score is not None:
+            for s in self.adj:
+                for p in self.adj[s]:
+                    self.score.setdefault(p, 0)
+        try:
+            self._search(self._order(), 0, frozenset(), {}, [])
+        except Timeout:
+            self.exhausted = False
+            if self.best is None:
+                raise
+        elapsed = time.perf_counter() - t0
+        if self.best is None:
+            return None
+        cost, assignment, instances = self.best
+        return Solution(assignment, instances, cost,
+                        self.exhausted or self.score is None, elapsed)
+
+
+def side_score(chip, side):
+    # Preference score that keeps signals near one edge of the package:
+    # 0 on the given edge ('left', 'right', 'top' or 'bottom') rising to 1
+    # on the opposite one.
+    w = max(chip.width - 1, 1)
+    h = max(chip.height - 1, 1)
+    f = {'left'   : lambda x, y: x / w,
+         'right'  : lambda x, y: (w - x) / w,
+         'top'    : lambda x, y: y / h,
+         'bottom' : lambda x, y: (h - y) / h}[side]
+    score = {}
+    for x, y, p in chip.cells:
+        if p._choices:
+            score.setdefault(p.name, f(x, y))
+    return score
+
+
+def solve(chip, requests, fixed=None, score=None, budget=10.):
+    # requests is a list of wish-list entries (see parse_request()); fixed
+    # maps pin names to the signal they must carry, or to None to keep the
+    # pin out of the solution.
+    signal_pins = chip.signal_pins()
+    groups      = []
+    for spec in requests:
+        groups += parse_request(spec, signal_pins)
+    for name, s in (fixed or {}).items():
+        if s is not None and not any(p.name == name
+                                     for p, _ in signal_pins.get(s, ())):
+            raise ValueError('%s cannot carry %s' % (name, s))
+    return Solver(chip, groups, fixed, score).solve(budget)
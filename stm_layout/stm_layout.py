@@ -2,13 +2,17 @@
 import argparse
 import curses
 import curses.ascii
+import json
+import os
 import sys
 import re
+import time
 
 import tgcurses
 import tgcurses.ui
 
-from stm_layout import chip_db, chip_stm
+from stm_layout import (chip_db, chip_stm, compat, config_check, output,
+                        pin_config, pin_diff, signal_index, solver, sweep)
 
 
 # Errors in documentation:
@@ -25,6 +29,8 @@ FOCUS        = FOCUS_CHIP
 LAST_FOCUS   = FOCUS_CHIP
 FOCUS_WIN    = None
 
+PINOUT_BASE  = '/tmp/stm32_pinout'
+
 REGEX_STR    = ''
 REGEX_POS    = 0
 REGEX        = None
@@ -41,21 +47,18 @@ RESISTORS = ['None', 'Pull-Up', 'Pull-Down']
 
 
 def draw_cpu(cpu_win, chip, cursor):
-    for x in range(chip.width):
-        for y in range(chip.height):
-            p = chip.pin_map[x][y]
-            if p is None:
-                continue
-
-            attr = p._attr
-            if p == cursor.pin:
-                if FOCUS == FOCUS_CHIP:
-                    attr |= curses.A_REVERSE
-                else:
-                    attr |= curses.A_BOLD
-            cpu_win.content.addstr('%-*s' % (cpu_win._label_len - 1, p.name),
-                                   pos=(y, x*cpu_win._label_len + 1),
-                                   attr=attr)
+    for x, y, p in chip.cells:
+        attr = p._attr
+        if chip.signals.is_conflicted(p):
+            attr = (attr & ~curses.A_COLOR) | curses.color_pair(2)
+        if p == cursor.pin:
+            if FOCUS == FOCUS_CHIP:
+                attr |= curses.A_REVERSE
+            else:
+                attr |= curses.A_BOLD
+        cpu_win.content.addstr('%-*s' % (cpu_win._label_len - 1, p.name),
+                               pos=(y, x*cpu_win._label_len + 1),
+                               attr=attr)
     cpu_win.content.noutrefresh()
 
 
@@ -83,7 +86,7 @@ def draw_info(info_win, pin):
         for i, v in enumerate(c.choices):
             hilite = curses.A_REVERSE if INFO_POS == y and is_f else 0
             attr   = pattr | hilite
-            if c.enabled[i]:
+            if c.is_enabled(i):
                 check = ' '
                 if i == c.val:
                     check = 'x'
@@ -98,7 +101,7 @@ def draw_info(info_win, pin):
     info_win.content.noutrefresh()
 
 
-def draw_alt_fns(alt_fns_win, alt_fns, pin_altfn):
+def draw_alt_fns(alt_fns_win, alt_fns, pin_altfn, signals):
     is_f = (FOCUS == FOCUS_ALTFNS)
     alt_fns_win.content.erase()
     for i, f in enumerate(alt_fns):
@@ -106,6 +109,9 @@ def draw_alt_fns(alt_fns_win, alt_fns, pin_altfn):
                  if (REGEX and ((i == pin_altfn and REGEX.search('x')) or
                                 REGEX.search(f)))
                  else 0)
+        if i == pin_altfn and any(signals.is_signal_conflicted(sig)
+                                  for sig in chip_stm.fn_signals(f)):
+            pattr = curses.color_pair(2)
         hilite = curses.A_REVERSE if ALTFNS_POS == i and is_f else 0
         attr   = pattr | hilite
         check  = ' '
@@ -160,7 +166,8 @@ def update_ui(cpu_win, info_win, alt_fns_win, add_fns_win, search_win, chip,
     update_regex(chip, REGEX)
     draw_cpu(cpu_win, chip, cursor)
     draw_info(info_win, cursor.pin)
-    draw_alt_fns(alt_fns_win, cursor.pin.alt_fns or [], cursor.pin._altfn)
+    draw_alt_fns(alt_fns_win, cursor.pin.alt_fns or [], cursor.pin._altfn,
+                 chip.signals)
     draw_add_fns(add_fns_win, cursor.pin.add_fns or [])
     draw_search_win(search_win)
 
@@ -193,7 +200,7 @@ def set_focus(focus, cpu_win, info_win, alt_fns_win, add_fns_win, search_win,
               cursor)
 
 
-def main(screen, chip):
+def main(screen, chip, writer, autosave=False):
     global REGEX
     global REGEX_STR
     global REGEX_POS
@@ -210,8 +217,10 @@ def main(screen, chip):
     name_len   = 15
     label_len  = 1
     for p in chip.pins.values():
-        alt_fn_len = max(alt_fn_len, max(len(f) for f in p.alt_fns+['']))
-        add_fn_len = max(add_fn_len, max(len(f) for f in p.add_fns+['']))
+        alt_fn_len = max(alt_fn_len, max((len(f) for f in p.alt_fns),
+                                         default=0))
+        add_fn_len = max(add_fn_len, max((len(f) for f in p.add_fns),
+                                         default=0))
         name_len   = max(len(p.full_name), name_len)
         label_len  = max(len(p.name) + 1, label_len)
         p._attr    = 0
@@ -219,6 +228,7 @@ def main(screen, chip):
     # Initialize colors.
     curses.use_default_colors()
     curses.init_pair(1, -1, curses.COLOR_GREEN)
+    curses.init_pair(2, -1, curses.COLOR_RED)
 
     # Create a workspace.
     ws = tgcurses.ui.Workspace(screen)
@@ -280,9 +290,7 @@ def main(screen, chip):
             set_focus(FOCUS_SEARCH, cpu_win, info_win, alt_fns_win,
                       add_fns_win, search_win, chip, cursor)
         elif FOCUS != FOCUS_SEARCH and c == ord('w'):
-            s = chip.serialize_settings()
-            with open('/tmp/stm32_pinout.txt', 'w', encoding='utf8') as f:
-                f.write(s)
+            writer.write(force=True)
         elif FOCUS != FOCUS_SEARCH and c == ord('r'):
             cursor.pin._reset()
         elif c == ord('\t'):
@@ -312,6 +320,10 @@ def main(screen, chip):
                 cursor.right()
             elif c in (ord('h'), curses.KEY_LEFT):
                 cursor.left()
+            elif c == ord('n'):
+                cursor.find(lambda p: p._attr & curses.color_pair(1))
+            elif ord('A') <= c <= ord('Z'):
+                cursor.jump(chip.port_ranks.get('P' + chr(c)))
         elif FOCUS == FOCUS_SEARCH:
             if c in (curses.KEY_BACKSPACE, curses.ascii.BS, curses.ascii.DEL):
                 if REGEX_POS:
@@ -353,28 +365,411 @@ def main(screen, chip):
             elif c in (ord('x'), ord('\n'), ord(' '), curses.KEY_ENTER):
                 cursor.pin._toggle_altfn(ALTFNS_POS)
 
+        if autosave:
+            writer.write()
         update_ui(cpu_win, info_win, alt_fns_win, add_fns_win, search_win, chip,
                   cursor)
 
 
+def _abbrev(names, n=4):
+    if len(names) <= n:
+        return ', '.join(names)
+    return '%s and %u more' % (', '.join(names[:n]), len(names) - n)
+
+
+def _signals_main(rv):
+    hits    = signal_index.lookup(rv.signal, af=rv.af, prefix=rv.prefix,
+                                  jobs=rv.jobs)
+    skipped = signal_index.skipped_parts(rv.prefix)
+    if skipped:
+        print('%u parts without usable pin data were not searched (%s)' % (
+            len(skipped), _abbrev(skipped)), file=sys.stderr)
+    if not hits:
+        print('No parts found with signal "%s"' % rv.signal)
+        sys.exit(1)
+    if rv.parts:
+        for partname in sorted(set(h.partname for h in hits)):
+            print(partname)
+        return
+    for h in hits:
+        print('%-24s %-16s %-12s %-6s %s' % (
+            h.signal, h.partname, h.package, h.key,
+            'AF%u' % h.af if h.af is not None else '-'))
+
+
+def _diff_main(rv):
+    pairs = []
+    if rv.chip:
+        if len(rv.chip) != 2:
+            print('diff needs exactly two -c options')
+            sys.exit(1)
+        pairs.append(tuple(rv.chip))
+    if rv.pairs:
+        with open(rv.pairs, encoding='utf8') as f:
+            for l in f:
+                names = l.split('#')[0].split()
+                if names:
+                    pairs.append(tuple(names[:2]))
+
+    # Each chip is built once no matter how many pairs it appears in.
+    chips = {}
+    for a, b in pairs:
+        for name in (a, b):
+            if name not in chips:
+                try:
+                    chips[name] = chip_stm.load_chip(name, jobs=rv.jobs)
+                except KeyError:
+                    print('No device found for "%s"' % name)
+                    sys.exit(1)
+
+        deltas = pin_diff.diff_chips(chips[a], chips[b])
+        print('%s -> %s: %u pins differ' % (a, b, len(deltas)))
+        for d in deltas:
+            print(pin_diff.format_delta(d))
+
+
+def _compat_main(rv):
+    result, skipped = compat.compat_matrix(rv.prefix, jobs=rv.jobs)
+    if skipped:
+        print('%u parts without usable pin data were left out (%s)' % (
+            len(skipped), _abbrev(skipped)), file=sys.stderr)
+    if not result:
+        print('No devices found for "%s"' % rv.prefix)
+        sys.exit(1)
+
+    write = compat.write_json if rv.format == 'json' else compat.write_csv
+    if rv.output:
+        with open(rv.output, 'w', encoding='utf8', newline='') as f:
+            write(result, f)
+    else:
+        write(result, sys.stdout)
+
+
+def _apply_main(rv):
+    if len(rv.config) > 1 and rv.output and not os.path.isdir(rv.output):
+        print('-o must be a directory when applying several configs')
+        sys.exit(1)
+
+    # Configs for the same part share one chip, reset between configs.
+    chips  = {}
+    failed = False
+    for path in rv.config:
+        try:
+            partname, pins = pin_config.load_config(path)
+        except OSError as e:
+            print('%s: %s' % (path, e), file=sys.stderr)
+            failed = True
+            continue
+        except ValueError as e:
+            # load_config() names the file itself.
+            print(e, file=sys.stderr)
+            failed = True
+            continue
+        partname = rv.chip or partname
+        if partname is None:
+            print('%s: no part given; use -c' % path, file=sys.stderr)
+            failed = True
+            continue
+
+        chip = chips.get(partname)
+        if chip is None:
+            try:
+                chip = chip_stm.load_chip(partname, jobs=rv.jobs)
+            except KeyError:
+                print('%s: no device found for "%s"' % (path, partname),
+                      file=sys.stderr)
+                failed = True
+                continue
+            chips[partname] = chip
+        else:
+            chip.reset()
+
+        problems = pin_config.apply_config(chip, pins)
+        if problems:
+            for p in problems:
+                print('%s: %s' % (path, pin_config.format_problem(p)),
+                      file=sys.stderr)
+            failed = True
+            continue
+
+        if len(rv.config) > 1 and rv.output:
+            base = os.path.splitext(os.path.basename(path))[0]
+            output.write_file(chip, os.path.join(
+                rv.output, base + output.BACKENDS[rv.format].extension),
+                              rv.format)
+        elif rv.output:
+            output.write_file(chip, rv.output, rv.format)
+        else:
+            backend = output.BACKENDS[rv.format]()
+            output.write_chip(chip, sys.stdout.buffer if backend.binary else
+                              sys.stdout, backend)
+
+    if failed:
+        sys.exit(1)
+
+
+def _check_main(rv):
+    t0      = time.perf_counter()
+    results = config_check.check_files(rv.config, partname=rv.chip,
+                                       jobs=rv.jobs)
+    report  = config_check.make_report(results, time.perf_counter() - t0)
+    if rv.output:
+        with open(rv.output, 'w', encoding='utf8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    if not report['ok']:
+        sys.exit(1)
+
+
+def _solve_main(rv):
+    try:
+        chip = chip_stm.load_chip(rv.chip, jobs=rv.jobs)
+    except KeyError:
+        print('No device found for "%s"' % rv.chip)
+        sys.exit(1)
+
+    fixed = {}
+    for f in rv.fix or []:
+        name, _, signal = f.partition('=')
+        fixed[name.strip().upper()] = signal.strip().upper()
+    for name in rv.reserve or []:
+        fixed[name.strip().upper()] = None
+    score = solver.side_score(chip, rv.prefer_side) if rv.prefer_side else None
+
+    try:
+        sol = solver.solve(chip, rv.request, fixed=fixed, score=score,
+                           budget=rv.budget)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    except solver.Timeout:
+        print('No assignment found in %.1f seconds' % rv.budget)
+        sys.exit(1)
+    if sol is None:
+        print('No conflict-free assignment exists')
+        sys.exit(1)
+
+    for spec, instance in sol.instances:
+        if spec != instance:
+            print('%-24s -> %s' % (spec, instance))
+    for signal in sorted(sol.assignment):
+        name, af = sol.assignment[signal]
+        print('%-24s %-6s AF%u' % (signal, name, af))
+    if score is not None:
+        print('cost %.3f%s' % (sol.cost, '' if sol.optimal else
+                               ' (time budget ran out; may not be optimal)'))
+
+    if rv.output:
+        config = {'part' : rv.chip,
+                  'pins' : {name: {'af' : af} for name, af
+                            in sol.assignment.values()}}
+        with open(rv.output, 'w', encoding='utf8') as f:
+            json.dump(config, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+def _sweep_main(rv):
+    t0 = time.perf_counter()
+    try:
+        candidates = sweep.sweep(rv.prefix, rv.request, side=rv.prefer_side,
+                                 budget=rv.budget, jobs=rv.jobs)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    elapsed = time.perf_counter() - t0
+
+    feasible = [c for c in candidates if c.cost is not None]
+    rejected = sum(1 for c in candidates if c.note == sweep.REJECTED)
+    failed   = [c for c in candidates if sweep.load_failed(c)]
+    for c in candidates:
+        if c.cost is None and not rv.all and not sweep.load_failed(c):
+            continue
+        if c.cost is None:
+            result = c.note
+        elif rv.prefer_side:
+            result = 'cost %.3f%s' % (c.cost, '' if c.optimal else ' (timeout)')
+        else:
+            result = 'ok'
+        print('%-20s %-10s %4u pins %6uK  %7.1f ms  %s' % (
+            c.partname, c.package, c.pin_count, c.flash // 1024,
+            c.seconds * 1e3, result))
+    print('%u of %u parts can host the requests (%u rejected by signal set) '
+          'in %.1f s' % (len(feasible), len(candidates) - len(failed),
+                         rejected, elapsed))
+    if failed:
+        print('%u parts failed to load and were not checked' % len(failed))
+    if not feasible:
+        sys.exit(1)
+
+
 def _main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--chip', '-c', required=True)
-    rv = parser.parse_args()
+    jobs_help   = ('parse device files in N processes when building an '
+                   'index (0 = one per CPU)')
+    jobs_parser = argparse.ArgumentParser(add_help=False)
+    jobs_parser.add_argument('--jobs', '-j', type=int, default=1,
+                             help=jobs_help)
+
+    # Subcommands take -j as well, but without a default of their own so
+    # that they don't overwrite one given before the subcommand.
+    sub_jobs_parser = argparse.ArgumentParser(add_help=False)
+    sub_jobs_parser.add_argument('--jobs', '-j', type=int,
+                                 default=argparse.SUPPRESS, help=jobs_help)
+
+    parser = argparse.ArgumentParser(parents=[jobs_parser])
+    parser.add_argument('--chip', '-c')
+    parser.add_argument('--filter',
+                        help='select parts by attributes, e.g. '
+                             '"family=stm32g4,package=LQFP64,flash>=256K"')
+    parser.add_argument('--format', choices=sorted(output.BACKENDS),
+                        default='text',
+                        help='register output format written by "w"')
+    parser.add_argument('--output', '-o',
+                        help='file written by "w" (default: %s plus an '
+                             'extension for the format)' % PINOUT_BASE)
+    parser.add_argument('--autosave', action='store_true',
+                        help='rewrite the output file after every change '
+                             'instead of only on "w"')
+    subparsers = parser.add_subparsers(dest='command')
+
+    signals_parser = subparsers.add_parser(
+            'signals', parents=[sub_jobs_parser],
+            help='find the parts and pins that provide a signal')
+    signals_parser.add_argument('signal',
+                                help='signal name or shell-style pattern, '
+                                     'e.g. USART3_TX or "USART*_TX"')
+    signals_parser.add_argument('--af', type=int,
+                                help='only match this alternate function')
+    signals_parser.add_argument('--prefix', '-p', default='stm32',
+                                help='only search parts with this prefix')
+    signals_parser.add_argument('--parts', action='store_true',
+                                help='only list the matching part names')
+    signals_parser.set_defaults(handler=_signals_main)
+
+    diff_parser = subparsers.add_parser(
+            'diff', parents=[sub_jobs_parser],
+            help='compare the pinouts of two parts')
+    diff_parser.add_argument('--chip', '-c', action='append',
+                             help='part to compare; give exactly two')
+    diff_parser.add_argument('--pairs',
+                             help='file with one "PART_A PART_B" pair per '
+                                  'line to compare in a batch')
+    diff_parser.set_defaults(handler=_diff_main)
+
+    compat_parser = subparsers.add_parser(
+            'compat', parents=[sub_jobs_parser],
+            help='footprint-compatibility matrix for a family')
+    compat_parser.add_argument('prefix', help='part prefix, e.g. stm32g47')
+    compat_parser.add_argument('--format', choices=['csv', 'json'],
+                               default='csv')
+    compat_parser.add_argument('--output', '-o',
+                               help='write to a file instead of stdout')
+    compat_parser.set_defaults(handler=_compat_main)
+
+    apply_parser = subparsers.add_parser(
+            'apply', parents=[sub_jobs_parser],
+            help='configure a part from pin configuration files and write '
+                 'its registers')
+    apply_parser.add_argument('config', nargs='+',
+                              help='.json, .yaml or .csv pin configuration')
+    apply_parser.add_argument('--chip', '-c',
+                              help='part to configure; overrides any "part" '
+                                   'in the configs')
+    apply_parser.add_argument('--format', choices=sorted(output.BACKENDS),
+                              default='text')
+    apply_parser.add_argument('--output', '-o',
+                              help='output file, or directory when given '
+                                   'several configs (default: stdout)')
+    apply_parser.set_defaults(handler=_apply_main)
+
+    check_parser = subparsers.add_parser(
+            'check', parents=[sub_jobs_parser],
+            help='validate pin configuration files and write a JSON report')
+    check_parser.add_argument('config', nargs='+',
+                              help='.json, .yaml or .csv pin configuration')
+    check_parser.add_argument('--chip', '-c',
+                              help='part to check against; overrides any '
+                                   '"part" in the configs')
+    check_parser.add_argument('--output', '-o',
+                              help='write the report to a file instead of '
+                                   'stdout')
+    check_parser.set_defaults(handler=_check_main)
+
+    solve_parser = subparsers.add_parser(
+            'solve', parents=[sub_jobs_parser],
+            help='find pins for a list of peripherals and signals')
+    solve_parser.add_argument('request', nargs='+',
+                              help='USART1_TX, USART1:TX,RX, SPI2, USART (any '
+                                   'instance), "TIM3:CH1,CH2" or "2*I2C"')
+    solve_parser.add_argument('--chip', '-c', required=True)
+    solve_parser.add_argument('--fix', action='append', metavar='PIN=SIGNAL',
+                              help='pin that must carry a signal')
+    solve_parser.add_argument('--reserve', action='append', metavar='PIN',
+                              help='pin that must not be used')
+    solve_parser.add_argument('--prefer-side',
+                              choices=['left', 'right', 'top', 'bottom'],
+                              help='prefer pins near one edge of the package')
+    solve_parser.add_argument('--budget', type=float, default=10.,
+                              help='time budget in seconds (default: 10)')
+    solve_parser.add_argument('--output', '-o',
+                              help='write the assignment as a pin '
+                                   'configuration for stm_layout apply')
+    solve_parser.set_defaults(handler=_solve_main)
+
+    sweep_parser = subparsers.add_parser(
+            'sweep', parents=[sub_jobs_parser],
+            help='rank the parts of a family that can host a list of '
+                 'peripherals')
+    sweep_parser.add_argument('prefix', help='part prefix, e.g. stm32g4')
+    sweep_parser.add_argument('request', nargs='+',
+                              help='requests as for the solve command')
+    sweep_parser.add_argument('--prefer-side',
+                              choices=['left', 'right', 'top', 'bottom'],
+                              help='rank equal parts by how close the '
+                                   'signals can stay to one package edge')
+    sweep_parser.add_argument('--budget', type=float, default=2.,
+                              help='time budget per part in seconds '
+                                   '(default: 2)')
+    sweep_parser.add_argument('--all', action='store_true',
+                              help='also list the parts that cannot host '
+                                   'the requests')
+    sweep_parser.set_defaults(handler=_sweep_main)
 
-    parts = chip_db.find(rv.chip)
+    rv = parser.parse_args()
+    if rv.command is not None:
+        rv.handler(rv)
+        return
+    if rv.chip is None and rv.filter is None:
+        parser.error('one of --chip or --filter is required')
+
+    if rv.filter is not None:
+        try:
+            parts = chip_db.query(rv.filter, jobs=rv.jobs)
+        except ValueError as e:
+            parser.error(str(e))
+        if rv.chip is not None:
+            parts = [p for p in parts if rv.chip in p.partname]
+    else:
+        parts = chip_db.find(rv.chip, jobs=rv.jobs)
     if not parts:
-        print('No devices found for "%s"' % rv.chip)
+        print('No devices found for "%s"' % (rv.chip or rv.filter))
         sys.exit(1)
-    part = next( (p for p in parts if rv.chip == p.partname), None)
+    if len(parts) == 1:
+        part = parts[0]
+    else:
+        part = next( (p for p in parts if rv.chip == p.partname), None)
     if part is None:
-        print('Multiple devices found for "%s"' % rv.chip)
+        print('Multiple devices found for "%s"' % (rv.chip or rv.filter))
         for p in parts:
-            print('%s - %s' % (p, chip_db.package(p)))
+            print('%s - %s' % (p, p.package))
         sys.exit(1)
     else:
-        chip = chip_stm.make_chip(part)
-        tgcurses.wrapper(main, chip)
+        chip   = chip_stm.make_chip(chip_db.get_device(part))
+        path   = rv.output or PINOUT_BASE + output.BACKENDS[rv.format].extension
+        writer = output.PinoutWriter(chip, path, rv.format)
+        tgcurses.wrapper(main, chip, writer, rv.autosave)
 
 
 if __name__ == '__main__':
@@ -2,7 +2,7 @@
 import argparse
 import sys
 
-from stm_layout import chip_db, chip_stm, chip_package
+from stm_layout import chip_db, chip_stm, chip_package, pin_config
 import stm_layout.tk
 
 
@@ -47,9 +47,10 @@ RECT_FILL       = 'white'
 HILITE_FILL     = 'lightblue'
 SELECT_FILL     = 'yellow'
 RE_FILL         = 'lightgreen'
+CONFLICT_FILL   = 'salmon'
 
 
-def main(chip, regex):
+def main(chip, regex, fps=stm_layout.tk.tk_elems.FRAME_RATE):
     if isinstance(chip.chip, chip_package.LQFP):
         cls = stm_layout.tk.LQFPWorkspace
     elif isinstance(chip.chip, chip_package.BGA):
@@ -59,7 +60,9 @@ def main(chip, regex):
     else:
         raise Exception('Unsupported chip package.')
 
-    ws = cls(chip, RECT_FILL, HILITE_FILL, SELECT_FILL, RE_FILL)
+    ws = cls(chip, RECT_FILL, HILITE_FILL, SELECT_FILL, RE_FILL, CONFLICT_FILL)
+    ws.set_frame_rate(fps)
+    ws.color_all_pins()
     if regex:
         ws.set_regex(regex)
 
@@ -68,23 +71,59 @@ def main(chip, regex):
 
 def _main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--chip', '-c', required=True)
+    parser.add_argument('--chip', '-c')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='parse device files in N processes when '
+                             'building the device index (0 = one per CPU)')
+    parser.add_argument('--filter',
+                        help='select parts by attributes, e.g. '
+                             '"family=stm32g4,package=LQFP64,flash>=256K"')
     parser.add_argument('--regex')
+    parser.add_argument('--config',
+                        help='pin configuration to show; pins that drive '
+                             'the same signal are highlighted')
+    parser.add_argument('--fps', type=float,
+                        default=stm_layout.tk.tk_elems.FRAME_RATE,
+                        help='handle mouse motion at most this many times '
+                             'a second (default %(default)s)')
     rv = parser.parse_args()
+    if rv.chip is None and rv.filter is None:
+        parser.error('one of --chip or --filter is required')
+    if rv.fps <= 0:
+        parser.error('--fps must be positive')
 
-    parts = chip_db.find(rv.chip)
+    if rv.filter is not None:
+        try:
+            parts = chip_db.query(rv.filter, jobs=rv.jobs)
+        except ValueError as e:
+            parser.error(str(e))
+        if rv.chip is not None:
+            parts = [p for p in parts if rv.chip in p.partname]
+    else:
+        parts = chip_db.find(rv.chip, jobs=rv.jobs)
     if not parts:
-        print('No devices found for "%s"' % rv.chip)
+        print('No devices found for "%s"' % (rv.chip or rv.filter))
         sys.exit(1)
-    part = next( (p for p in parts if rv.chip == p.partname), None)
+    if len(parts) == 1:
+        part = parts[0]
+    else:
+        part = next( (p for p in parts if rv.chip == p.partname), None)
     if part is None:
-        print('Multiple devices found for "%s"' % rv.chip)
+        print('Multiple devices found for "%s"' % (rv.chip or rv.filter))
         for p in parts:
-            print('%s - %s' % (p, chip_db.package(p)))
+            print('%s - %s' % (p, p.package))
         sys.exit(1)
     else:
-        chip = chip_stm.make_chip(part)
-        main(chip, rv.regex)
+        chip = chip_stm.make_chip(chip_db.get_device(part))
+        if rv.config is not None:
+            try:
+                _, pins = pin_config.load_config(rv.config)
+            except (OSError, ValueError) as e:
+                parser.error(str(e))
+            for p in pin_config.check_config(chip, pins):
+                print('%s: %s' % (rv.config, pin_config.format_problem(p)),
+                      file=sys.stderr)
+        main(chip, rv.regex, rv.fps)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,144 @@
+import collections
+import time
+
+import modm_devices.parser
+
+from . import chip_db
+from . import chip_stm
+from . import signal_index
+from . import solver
+
+
+# One part's outcome.  cost is None for parts with no assignment; note says
+# why (rejected by its signal set, no assignment or timed out).  Parts whose
+# chip couldn't be built have a note starting with LOAD_ERROR and say
+# nothing about whether they could host the requests.
+Candidate = collections.namedtuple('Candidate',
+                                   ['partname', 'package', 'pin_count',
+                                    'flash', 'cost', 'optimal', 'seconds',
+                                    'note'])
+
+REJECTED   = 'missing signals'
+INFEASIBLE = 'no assignment'
+TIMEOUT    = 'timeout'
+LOAD_ERROR = 'load error'
+
+
+def _signal_masks(prefix, jobs):
+    # Returns ({signal: bit}, {partname: (pinout, mask of the alternate-
+    # function signals on the part)}) from the signal index.  Parts with the
+    # same pinout number have identical signal-to-pin maps.
+    signal_index.build(prefix, jobs)
+    bits  = {}
+    masks = collections.defaultdict(int)
+    for s, entries in signal_index.SIGNALS.items():
+        for pinout, _, af in entries:
+            if af is None:
+                continue
+            bit            = bits.setdefault(s, 1 << len(bits))
+            masks[pinout] |= bit
+    parts = {}
+    for i, pinout_parts in enumerate(signal_index.PINOUTS):
+        for partname, _ in pinout_parts:
+            parts[partname] = (i, masks[i])
+    return bits, parts
+
+
+def _group_masks(groups, bits):
+    # For each group, the signal masks of its candidate instances.
+    return [[sum(bits[s] for s in ('%s_%s' % (i, r) for r in g.roles))
+             for i in g.instances]
+            for g in groups]
+
+
+def _solve_chip(chip, requests, side, budget):
+    # Returns (cost, optimal, note).
+    score = solver.side_score(chip, side) if side else None
+    try:
+        sol = solver.solve(chip, requests, score=score, budget=budget)
+    except solver.Timeout:
+        return (None, False, TIMEOUT)
+    except ValueError as e:
+        return (None, False, str(e))
+    if sol is None:
+        return (None, False, INFEASIBLE)
+    return (sol.cost, sol.optimal, '')
+
+
+def _solve_file(task):
+    filename, partnames, requests, side, budget = task
+    parser  = modm_devices.parser.DeviceParser()
+    devfile = parser.parse(filename)
+    results = []
+    for device in devfile.get_devices():
+        if device.partname not in partnames:
+            continue
+        t0 = time.perf_counter()
+        try:
+            chip = chip_stm.make_chip(device)
+        except (ValueError, IndexError, KeyError) as e:
+            result = (None, False, '%s: %s %s' % (LOAD_ERROR,
+                                                  type(e).__name__, e))
+        else:
+            result = _solve_chip(chip, requests, side, budget)
+        results.append((device.partname,) + result +
+                       (time.perf_counter() - t0,))
+    return results
+
+
+def load_failed(candidate):
+    return candidate.note.startswith(LOAD_ERROR)
+
+
+def sweep(prefix, requests, side=None, budget=10., jobs=1):
+    # Returns a Candidate for every part matching prefix: the parts that can
+    # host the requests first, ranked by pin count, flash and preference
+    # cost, followed by those that can't and then those that failed to
+    # load.
+    #
+    # Parts are first screened with bitsets of the signals they provide:
+    # unless some candidate instance of every request has all of its signals
+    # on the part, it can't be a solution and no chip is built for it.  Of
+    # the survivors, only one part per distinct pinout and package is solved
+    # (in a process pool, one task per device file) and the others share its
+    # result.
+    parts       = chip_db.find(prefix, jobs=jobs)
+    bits, masks = _signal_masks(prefix, jobs)
+    universe    = dict.fromkeys(bits)
+    groups      = []
+    for spec in requests:
+        groups += solver.parse_request(spec, universe)
+    group_masks = _group_masks(groups, bits)
+
+    candidates = []
+    sharing    = collections.defaultdict(list)
+    for p in parts:
+        pinout, mask = masks.get(p.partname, (None, 0))
+        if p.partname in signal_index.SKIPPED:
+            # Not in the signal index, so not screened; solving it reports
+            # why its pin data couldn't be read.
+            sharing[None, p.partname].append(p)
+        elif all(any(m & mask == m for m in gm) for gm in group_masks):
+            sharing[pinout, p.package].append(p)
+        else:
+            candidates.append(Candidate(p.partname, p.package, p.pin_count,
+                                        p.flash, None, False, 0., REJECTED))
+
+    reps      = {}
+    survivors = collections.defaultdict(set)
+    for group in sharing.values():
+        reps[group[0].partname] = group
+        survivors[group[0].filename].add(group[0].partname)
+    tasks = [(filename, survivors[filename], requests, side, budget)
+             for filename in sorted(survivors)]
+    for results in chip_db.map_files(_solve_file, tasks, jobs):
+        for partname, cost, optimal, note, seconds in results:
+            for p in reps[partname]:
+                candidates.append(Candidate(p.partname, p.package,
+                                            p.pin_count, p.flash, cost,
+                                            optimal, seconds, note))
+
+    candidates.sort(key=lambda c: (c.cost is None, load_failed(c),
+                                   c.pin_count, c.flash, c.cost or 0,
+                                   c.partname))
+    return candidates
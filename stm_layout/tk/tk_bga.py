@@ -26,27 +26,23 @@ class BGAWorkspace(tk_workspace.Workspace):
         self._root.rowconfigure(0, weight=1)
 
         m = c.add_rectangle(pad, pad + dy, w, h, fill=self.elem_fill)
-        for x in range(cw):
-            for y in range(ch):
-                p = self.chip.chip.pins[x][y]
-                if p is None:
-                    continue
-
-                o = c.add_oval(
-                        m.x + PIN_SPACE + x*PIN_DELTA,
-                        m.y + PIN_SPACE + y*PIN_DELTA,
-                        PIN_DIAM, PIN_DIAM,
-                        fill=self.elem_fill)
-                self.pin_elems.append(o)
-                c.add_text(
-                        o.x + o.width / 2,
-                        o.y + o.height + xplat.BGA_PIN_NAME_DY,
-                        font=self.label_font, text=p.name, anchor='n')
-                c.add_text(
-                        o.x + o.width / 2 + xplat.BGA_PIN_KEY_DX,
-                        o.y + o.height / 2 + xplat.BGA_PIN_KEY_DY,
-                        font=self.pin_font, text=p.key, anchor='c')
-                o.pin = p
+        for x, y, p in self.chip.cells:
+            o = c.add_oval(
+                    m.x + PIN_SPACE + x*PIN_DELTA,
+                    m.y + PIN_SPACE + y*PIN_DELTA,
+                    PIN_DIAM, PIN_DIAM,
+                    fill=self.elem_fill)
+            self.pin_elems.append(o)
+            c.add_text(
+                    o.x + o.width / 2,
+                    o.y + o.height + xplat.BGA_PIN_NAME_DY,
+                    font=self.label_font, text=p.name, anchor='n')
+            c.add_text(
+                    o.x + o.width / 2 + xplat.BGA_PIN_KEY_DX,
+                    o.y + o.height / 2 + xplat.BGA_PIN_KEY_DY,
+                    font=self.pin_font, text=p.key, anchor='c')
+            o.pin = p
+        self.index_pins()
 
         package_name = chip_db.package(self.chip.part)
         c.add_text(m.x, m.y, font=self.label_font, text=self.chip.name,
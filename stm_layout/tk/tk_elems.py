@@ -1,5 +1,10 @@
 import tkinter
 import ctypes
+import time
+
+
+# Default rate at which mouse motion is handled, in frames per second.
+FRAME_RATE = 60
 
 
 class Elem:
@@ -77,8 +82,14 @@ class Entry(Widget):
 
 
 class Canvas:
+    # Fill changes are batched: set_fill() only records the new fill and the
+    # changes are applied together when Tk next goes idle, skipping items
+    # whose fill ends up unchanged.
     def __init__(self, canvas):
-        self._canvas = canvas
+        self._canvas   = canvas
+        self._fills    = {}
+        self._applied  = {}
+        self._flush_id = None
 
     def _bbox(self, elem):
         return self._canvas.bbox(elem._elem_id)
@@ -87,7 +98,19 @@ class Canvas:
         self._canvas.tag_lower(bottom_elem._elem_id, top_elem._elem_id)
 
     def _set_fill(self, elem, fill):
-        self._canvas.itemconfig(elem._elem_id, fill=fill)
+        self._fills[elem._elem_id] = fill
+        if self._flush_id is None:
+            self._flush_id = self._canvas.after_idle(self.flush_fills)
+
+    def flush_fills(self):
+        if self._flush_id is not None:
+            self._canvas.after_cancel(self._flush_id)
+            self._flush_id = None
+        for elem_id, fill in self._fills.items():
+            if self._applied.get(elem_id) != fill:
+                self._canvas.itemconfig(elem_id, fill=fill)
+                self._applied[elem_id] = fill
+        self._fills.clear()
 
     def _move_to(self, elem, *args):
         self._canvas.coords(elem._elem_id, *args)
@@ -98,11 +121,13 @@ class Canvas:
     def add_rectangle(self, x, y, width, height, **kwargs):
         elem_id = self._canvas.create_rectangle(
                 (x, y, x + width, y + height), **kwargs)
+        self._applied[elem_id] = kwargs.get('fill', '')
         return CanvasElem(self, elem_id, x, y, width=width, height=height)
 
     def add_oval(self, x, y, width, height, **kwargs):
         elem_id = self._canvas.create_oval(
                 (x, y, x + width, y + height), **kwargs)
+        self._applied[elem_id] = kwargs.get('fill', '')
         return CanvasElem(self, elem_id, x, y, width=width, height=height)
 
     def add_text(self, x, y, **kwargs):
@@ -128,6 +153,12 @@ class TKBase:
         # Windows hack #2.
         self._root.tk.call('tk', 'scaling', 1.0)
 
+        self.frame_rate      = FRAME_RATE
+        self._motion_handler = None
+        self._motion_event   = None
+        self._motion_id      = None
+        self._next_frame     = 0.
+
     def set_geometry(self, x, y, width, height):
         self._root.geometry('%ux%u+%u+%u' % (width, height, x, y))
 
@@ -143,11 +174,46 @@ class TKBase:
     def register_handler(self, event_type, handler):
         self._root.bind(event_type, lambda e: handler(self, e, e.x, e.y))
 
+    def set_frame_rate(self, frame_rate):
+        self.frame_rate = frame_rate
+
     def register_mouse_moved(self, handler):
-        self.register_handler('<Motion>', handler)
+        # <Motion> events are coalesced: only the latest position is handled,
+        # when Tk next goes idle but no more than frame_rate times a second.
+        self._motion_handler = handler
+        self._root.bind('<Motion>', self._motion)
+
+    def _motion(self, ev):
+        self._motion_event = ev
+        if self._motion_id is not None:
+            return
+        delay = self._next_frame - time.monotonic()
+        if delay > 0:
+            self._motion_id = self._root.after(int(delay*1000) + 1,
+                                               self.flush_motion)
+        else:
+            self._motion_id = self._root.after_idle(self.flush_motion)
+
+    def flush_motion(self):
+        # Handles the pending motion event, if any, right away.
+        if self._motion_id is None:
+            return
+        self._root.after_cancel(self._motion_id)
+        self._motion_id  = None
+        self._next_frame = time.monotonic() + 1. / self.frame_rate
+        ev               = self._motion_event
+        self._motion_handler(self, ev, ev.x, ev.y)
+
+    def register_button_handler(self, event_type, handler):
+        # Button handlers first catch up with the latest motion, so that they
+        # see the pin under the pointer where the button was pressed.
+        def button(e):
+            self.flush_motion()
+            handler(self, e, e.x, e.y)
+        self._root.bind(event_type, button)
 
     def register_mouse_down(self, handler):
-        self.register_handler('<Button-1>', handler)
+        self.register_button_handler('<Button-1>', handler)
 
     def register_mouse_up(self, handler):
-        self.register_handler('<ButtonRelease-1>', handler)
+        self.register_button_handler('<ButtonRelease-1>', handler)
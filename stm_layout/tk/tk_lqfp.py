@@ -22,24 +22,20 @@ class LQFPWorkspace(tk_edgy.Workspace):
         self._root.columnconfigure(0, weight=1)
         self._root.rowconfigure(0, weight=1)
 
-        l0 = 1
-        b0 = l0 + ch
-        r0 = b0 + cw
-        t0 = r0 + ch
         m = c.add_rectangle(pad, pad, w, h, fill=self.elem_fill)
-        for _, p in self.chip.pins.items():
-            i = int(p.key)
-            if l0 <= i < b0:
-                r = self.add_l_pin(p, m.x - self.pin_length, m.ty, m.by, i - l0)
-            elif b0 <= i < r0:
-                r = self.add_b_pin(p, m.lx, m.rx, i - b0, m.y + m.height)
-            elif r0 <= i < t0:
-                r = self.add_r_pin(p, m.x + m.width, m.by, m.ty, i - r0)
+        for x, y, p in self.chip.cells:
+            if x == 0:
+                r = self.add_l_pin(p, m.x - self.pin_length, m.ty, m.by, y - 1)
+            elif y == ch + 1:
+                r = self.add_b_pin(p, m.lx, m.rx, x - 1, m.y + m.height)
+            elif x == cw + 1:
+                r = self.add_r_pin(p, m.x + m.width, m.by, m.ty, ch - y)
             else:
-                r = self.add_t_pin(p, m.rx, m.lx, i - t0, m.y - self.pin_length)
+                r = self.add_t_pin(p, m.rx, m.lx, cw - x, m.y - self.pin_length)
 
             self.pin_elems.append(r)
             r.pin = p
+        self.index_pins()
 
         package_name = chip_db.package(self.chip.part)
         c.add_text(
@@ -0,0 +1,114 @@
+import math
+
+
+class GridIndex:
+    # Finds the element whose centre is nearest a point, the same answer a
+    # scan with CanvasElem.distance_squared() gives (ties go to the element
+    # added last).  Elements are anything with x and y and, optionally, width
+    # and height.
+    #
+    # Centres are bucketed on a uniform grid sized for about one element per
+    # cell, spanning the centres and the optional (x0, y0, x1, y1) bounds of
+    # where lookups are expected.  The first lookup in a cell works out which
+    # elements can be nearest to any point of it, so later lookups there only
+    # compare those.  Points off the grid search rings of buckets outwards
+    # instead, until no unsearched bucket can hold anything nearer.
+    def __init__(self, elems, bounds=None):
+        self.elems   = list(elems)
+        self.centres = [(i, e.x + getattr(e, 'width', 0) / 2,
+                         e.y + getattr(e, 'height', 0) / 2, e)
+                        for i, e in enumerate(self.elems)]
+        xs           = [cx for _, cx, _, _ in self.centres] or [0]
+        ys           = [cy for _, _, cy, _ in self.centres] or [0]
+        if bounds is not None:
+            xs += [bounds[0], bounds[2]]
+            ys += [bounds[1], bounds[3]]
+        n            = max(len(self.elems), 1)
+        self.x0      = min(xs)
+        self.y0      = min(ys)
+        w            = max(xs) - self.x0
+        h            = max(ys) - self.y0
+        self.cell    = max(math.sqrt(w*h / n), w / n, h / n, 1.)
+        self.nx      = int(w / self.cell) + 1
+        self.ny      = int(h / self.cell) + 1
+        self.buckets = {}
+        for c in self.centres:
+            self.buckets.setdefault(self._cell(c[1], c[2]), []).append(c)
+        self.candidates = {}
+
+    def _cell(self, x, y):
+        gx = min(max(int((x - self.x0) / self.cell), 0), self.nx - 1)
+        gy = min(max(int((y - self.y0) / self.cell), 0), self.ny - 1)
+        return gx, gy
+
+    def _candidates(self, gx, gy):
+        # An element can only be nearest to some point of the cell if its
+        # distance to the cell is no more than the smallest distance from
+        # any element to the cell's farthest corner.
+        ax = self.x0 + gx*self.cell
+        ay = self.y0 + gy*self.cell
+        bx = ax + self.cell
+        by = ay + self.cell
+        near = []
+        far  = []
+        for _, cx, cy, _ in self.centres:
+            dx = max(ax - cx, 0, cx - bx)
+            dy = max(ay - cy, 0, cy - by)
+            near.append(dx*dx + dy*dy)
+            dx = max(cx - ax, bx - cx)
+            dy = max(cy - ay, by - cy)
+            far.append(dx*dx + dy*dy)
+        bound = min(far)
+        return [c for c, d in zip(self.centres, near) if d <= bound]
+
+    def _ring(self, gx, gy, r):
+        if r == 0:
+            yield gx, gy
+            return
+        x0 = max(gx - r, 0)
+        x1 = min(gx + r, self.nx - 1)
+        for y in (gy - r, gy + r):
+            if 0 <= y < self.ny:
+                for x in range(x0, x1 + 1):
+                    yield x, y
+        y0 = max(gy - r + 1, 0)
+        y1 = min(gy + r - 1, self.ny - 1)
+        for x in (gx - r, gx + r):
+            if 0 <= x < self.nx:
+                for y in range(y0, y1 + 1):
+                    yield x, y
+
+    @staticmethod
+    def _closest(cands, x, y, best):
+        # best is None or (distance squared, -index, elem) of the nearest
+        # element so far.
+        for i, cx, cy, e in cands:
+            d = (x - cx)*(x - cx) + (y - cy)*(y - cy)
+            if best is None or (d, -i) < best[:2]:
+                best = (d, -i, e)
+        return best
+
+    def nearest(self, x, y):
+        # Returns None only if there are no elements.
+        if not self.centres:
+            return None
+        gx = (x - self.x0) / self.cell
+        gy = (y - self.y0) / self.cell
+        if 0 <= gx < self.nx and 0 <= gy < self.ny:
+            key   = (int(gx), int(gy))
+            cands = self.candidates.get(key)
+            if cands is None:
+                cands = self.candidates[key] = self._candidates(*key)
+            best  = self._closest(cands, x, y, None)
+        else:
+            # After searching ring r, every element left is more than r
+            # cells away along some axis.
+            gx, gy = self._cell(x, y)
+            best   = None
+            for r in range(max(self.nx, self.ny)):
+                for key in self._ring(gx, gy, r):
+                    best = self._closest(self.buckets.get(key, ()), x, y,
+                                         best)
+                if best is not None and best[0] < (r*self.cell)**2:
+                    break
+        return best[2] if best is not None else None
@@ -24,18 +24,16 @@ class TSSOPWorkspace(tk_edgy.Workspace):
         self._root.columnconfigure(0, weight=1)
         self._root.rowconfigure(0, weight=1)
 
-        l0 = 1
-        r0 = l0 + ch
         m = c.add_rectangle(pad, pad, w, h, fill=self.elem_fill)
-        for _, p in self.chip.pins.items():
-            i = int(p.key)
-            if l0 <= i < r0:
-                r = self.add_l_pin(p, m.x - self.pin_length, m.ty, m.by, i - l0)
+        for x, y, p in self.chip.cells:
+            if x == 0:
+                r = self.add_l_pin(p, m.x - self.pin_length, m.ty, m.by, y)
             else:
-                r = self.add_r_pin(p, m.x + m.width, m.by, m.ty, i - r0)
+                r = self.add_r_pin(p, m.x + m.width, m.by, m.ty, y)
 
             self.pin_elems.append(r)
             r.pin = p
+        self.index_pins()
 
         package_name = chip_db.package(self.chip.part)
         c.add_text(
@@ -2,7 +2,13 @@ import re
 import tkinter.font
 
 from .tk_elems import TKBase
+from .tk_spatial import GridIndex
 from . import xplat
+from .. import chip_stm
+
+
+# Typing in the regex entry is applied once it pauses for this long.
+REGEX_DELAY_MS = 150
 
 
 class InfoText:
@@ -14,28 +20,39 @@ class InfoText:
         self.fill_rect = canvas.add_rectangle(bbox[0], bbox[1], width, height,
                                               outline='')
         self.fill_rect.tag_lower(self.text)
+        self._text     = None
+        self._bg       = None
 
     def set_text(self, text):
-        self.text.set_text(text)
+        if text != self._text:
+            self.text.set_text(text)
+            self._text = text
 
     def set_bg(self, bg_color):
-        self.fill_rect.set_fill(bg_color)
+        if bg_color != self._bg:
+            self.fill_rect.set_fill(bg_color)
+            self._bg = bg_color
 
 
 class Workspace(TKBase):
-    def __init__(self, chip, elem_fill, hilite_fill, select_fill, re_fill):
+    def __init__(self, chip, elem_fill, hilite_fill, select_fill, re_fill,
+                 conflict_fill):
         super().__init__()
 
-        self.chip         = chip
-        self.elem_fill    = elem_fill
-        self.hilite_fill  = hilite_fill
-        self.select_fill  = select_fill
-        self.re_fill      = re_fill
-        self.hilited_pin  = None
-        self.selected_pin = None
-        self.re_pins      = set()
-        self.pin_elems    = []
-        self.regex        = None
+        self.chip          = chip
+        self.elem_fill     = elem_fill
+        self.hilite_fill   = hilite_fill
+        self.select_fill   = select_fill
+        self.re_fill       = re_fill
+        self.conflict_fill = conflict_fill
+        self.hilited_pin   = None
+        self.selected_pin  = None
+        self.re_pins       = set()
+        self.pin_elems     = []
+        self.pin_index     = None
+        self.regex         = None
+        self._regex_id     = None
+        self._pin_fields   = {}
 
         d = chip.part.get_driver('rcc')
         if d and 'max-frequency' in d:
@@ -67,7 +84,7 @@ class Workspace(TKBase):
         self.mcu_canvas   = None
 
         sv = tkinter.StringVar()
-        sv.trace_add('write', lambda n, i, m: self.set_regex(sv.get()))
+        sv.trace_add('write', lambda n, i, m: self.schedule_regex(sv.get()))
         e = self.info_canvas.add_entry(font=self.label_font, width=40,
                                        textvariable=sv)
 
@@ -143,9 +160,14 @@ class Workspace(TKBase):
         else:
             self.pin_pos_text.set_bg('')
 
+        signals = self.chip.signals
         for i, f in enumerate(pin_elem.pin.alt_fns):
             self.info_af_texts[i].set_text(' %2u: %s' % (i, f))
-            if self.regex and self.regex.search(f):
+            if i == pin_elem.pin._altfn and any(
+                    signals.is_signal_conflicted(s)
+                    for s in chip_stm.fn_signals(f)):
+                self.info_af_texts[i].set_bg(self.conflict_fill)
+            elif self.regex and self.regex.search(f):
                 self.info_af_texts[i].set_bg(self.re_fill)
             else:
                 self.info_af_texts[i].set_bg('')
@@ -163,11 +185,19 @@ class Workspace(TKBase):
             self.info_add_fns_texts[i].set_text('')
             self.info_add_fns_texts[i].set_bg('')
 
+    def index_pins(self):
+        # Called by the package workspaces once their pin_elems are placed.
+        c = self.mcu_canvas._canvas
+        self.pin_index = GridIndex(self.pin_elems,
+                                   (0, 0, int(c['width']), int(c['height'])))
+
     def color_pin(self, pin_elem):
         if self.hilited_pin == pin_elem:
             pin_elem.set_fill(self.hilite_fill)
         elif self.selected_pin == pin_elem:
             pin_elem.set_fill(self.select_fill)
+        elif self.chip.signals.is_conflicted(pin_elem.pin):
+            pin_elem.set_fill(self.conflict_fill)
         elif pin_elem in self.re_pins:
             pin_elem.set_fill(self.re_fill)
         else:
@@ -185,14 +215,7 @@ class Workspace(TKBase):
                 self.color_pin(prev_hilited_pin)
             return
 
-        closest  = self.pin_elems[-1]
-        distance = closest.distance_squared(x, y)
-        for e in reversed(self.pin_elems):
-            d = e.distance_squared(x, y)
-            if d < distance:
-                distance = d
-                closest  = e
-
+        closest = self.pin_index.nearest(x, y)
         if self.hilited_pin is not None:
             if closest == self.hilited_pin:
                 return
@@ -221,23 +244,38 @@ class Workspace(TKBase):
 
         self.update_info(self.selected_pin)
 
+    def schedule_regex(self, regex):
+        # Called on every keystroke in the regex entry; the regex is only
+        # applied once typing pauses for REGEX_DELAY_MS.
+        if self._regex_id is not None:
+            self._root.after_cancel(self._regex_id)
+        self._regex_id = self._root.after(REGEX_DELAY_MS,
+                                          lambda: self.set_regex(regex))
+
+    def match_pins(self):
+        # The pin elements whose name, key or any function matches the
+        # regex.  Each pin's strings are gathered once, without duplicates.
+        if not self._pin_fields:
+            for pe in self.pin_elems:
+                p = pe.pin
+                self._pin_fields[pe] = tuple(dict.fromkeys(
+                    [p.full_name, p.key] + list(p.alt_fns) + list(p.add_fns)))
+        r = self.regex
+        return {pe for pe, fields in self._pin_fields.items()
+                if any(r.search(f) for f in fields)}
+
     def set_regex(self, regex):
+        self._regex_id = None
         try:
             self.regex = re.compile(regex) if regex else None
         except Exception:
             self.regex = None
 
-        self.re_pins.clear()
-        if self.regex is not None:
-            r = self.regex
-            for pe in self.pin_elems:
-                match = r.search(pe.pin.full_name)
-                match = match or r.search(pe.pin.key)
-                match = match or any(r.search(f) for f in pe.pin.alt_fns)
-                match = match or any(r.search(f) for f in pe.pin.add_fns)
-                if match:
-                    self.re_pins.add(pe)
-
-        self.color_all_pins()
+        # Only pins that entered or left the match set change colour.
+        re_pins      = self.match_pins() if self.regex is not None else set()
+        changed      = re_pins ^ self.re_pins
+        self.re_pins = re_pins
+        for pe in changed:
+            self.color_pin(pe)
         if self.selected_pin:
             self.update_info(self.selected_pin)
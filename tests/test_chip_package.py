@@ -0,0 +1,60 @@
+from stm_layout import chip_package
+
+
+def _lqfp(n):
+    # An LQFP with n pins per side, each pin its own number.
+    pkg = chip_package.LQFP(n, n)
+    for i in range(4*n):
+        pkg[str(i + 1)] = i + 1
+    pkg.link()
+    return pkg
+
+
+def test_lqfp_rotate():
+    pkg = _lqfp(4)
+    c   = pkg.cursor()
+    assert c.pin == 1
+    c.clockwise()
+    assert c.pin == 16
+    c.counterclockwise()
+    c.counterclockwise()
+    assert c.pin == 2
+    for _ in range(16):
+        c.counterclockwise()
+    assert c.pin == 2
+
+
+def test_lqfp_arrows():
+    # The arrow keys step around the edge the way they point, and do nothing
+    # across it.
+    pkg = _lqfp(4)
+    c   = pkg.cursor()
+    c.down()
+    assert c.pin == 2
+    c.up()
+    c.up()
+    assert c.pin == 16
+    c.right()
+    assert c.pin == 15
+    c.left()
+    c.left()
+    assert c.pin == 1
+    c.right()
+    assert c.pin == 1
+
+
+def test_bga_moves():
+    pkg = chip_package.BGA(3, 2)
+    for key in ('A1', 'A3', 'B1', 'B2', 'B3'):
+        pkg[key] = key
+    pkg.link()
+    c = pkg.cursor()
+    assert c.pin == 'A1'
+    assert not hasattr(c, 'clockwise')
+    c.right()
+    assert c.pin == 'A3'
+    c.down()
+    c.left()
+    assert c.pin == 'B2'
+    c.up()
+    assert c.pin == 'B2'
@@ -0,0 +1,31 @@
+from stm_layout import compat
+
+
+def _pinout(partname, placement, functions):
+    return compat.PartPinout(partname, 'TFBGA240', placement, functions,
+                             compat._digest(functions))
+
+
+def test_equal_functions_different_placement():
+    # a and b have the same functions but different placements; c shares
+    # b's placement with a superset of its functions.
+    small = {'A1' : ['AF7:USART1_TX'], 'A2' : []}
+    big   = {'A1' : ['AF7:USART1_TX'], 'A2' : ['AF5:SPI1_SCK']}
+    a     = _pinout('a', 'p1', small)
+    b     = _pinout('b', 'p2', small)
+    c     = _pinout('c', 'p2', big)
+
+    assert compat._package_matrix([a, b, c]) == [
+        [compat.SAME, compat.INCOMPATIBLE, compat.INCOMPATIBLE],
+        [compat.INCOMPATIBLE, compat.SAME, compat.SUBSET],
+        [compat.INCOMPATIBLE, compat.SUPERSET, compat.SAME],
+    ]
+
+
+def test_skipped_parts():
+    # make_pins() can't parse stm32h503 pin names like PA13(JTMS-SWDIO), so
+    # those parts are reported rather than silently left out.
+    result, skipped = compat.compat_matrix('stm32h503')
+    assert 'stm32h503cbt6' in skipped
+    assert all('stm32h503cbt6' not in partnames
+               for partnames, _ in result.values())
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from stm_layout import config_check, pin_config
+
+
+PART = 'stm32g474cet6'
+
+
+def _write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def _json(tmp_path, name, config):
+    return _write(tmp_path, name, json.dumps(config))
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_check_files(tmp_path, jobs):
+    good    = _json(tmp_path, 'good.json',
+                    {'part' : PART, 'pins' : {'PA9' : {'af' : 7}}})
+    lists   = _json(tmp_path, 'lists.json',
+                    {'part' : PART, 'pins' : {'PA0' : {'mode' : [1]},
+                                              'PA1' : {1 : 'x', 'y' : 2}}})
+    nopart  = _json(tmp_path, 'nopart.json', {'pins' : {}})
+    badpart = _json(tmp_path, 'badpart.json',
+                    {'part' : ['x'], 'pins' : {}})
+    unknown = _json(tmp_path, 'unknown.json',
+                    {'part' : 'stm32x000', 'pins' : {}})
+    broken  = _write(tmp_path, 'broken.json', '{"pins": ')
+    paths   = [good, broken, lists, nopart, good, badpart, unknown]
+    if pin_config.yaml is not None:
+        paths.append(_write(tmp_path, 'broken.yaml', 'pins: {PA0: [\n'))
+
+    results = config_check.check_files(paths, jobs=jobs)
+    assert [r.path for r in results] == paths
+    kinds   = [[p.kind for p in r.problems] for r in results]
+    assert kinds[:7] == [
+        [],
+        [pin_config.BAD_FILE],
+        [pin_config.BAD_VALUE, pin_config.BAD_VALUE],
+        [pin_config.UNKNOWN_PART],
+        [],
+        [pin_config.BAD_FILE],
+        [pin_config.UNKNOWN_PART],
+        ]
+    assert kinds[7:] in ([], [[pin_config.BAD_FILE]])
+
+    report = config_check.make_report(results, 0)
+    assert not report['ok']
+    assert len(report['files']) == len(paths)
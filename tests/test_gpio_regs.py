@@ -0,0 +1,50 @@
+import random
+
+from stm_layout import chip_stm, gpio_regs
+
+
+def _words(rng):
+    words    = [rng.getrandbits(32) for _ in range(6)]
+    words[1] &= 0xFFFF
+    return tuple(words)
+
+
+def test_round_trip():
+    rng = random.Random(0)
+    for _ in range(200):
+        words = _words(rng)
+        lanes = gpio_regs.decode_port(*words)
+        assert gpio_regs.encode_port(*lanes) == words
+        assert gpio_regs.encode_port(*map(list, lanes)) == words
+
+
+def test_decode_lanes():
+    lanes = gpio_regs.decode_port(0x0000000C, 0x0002, 0, 0x80000000,
+                                  0x000000A0, 0xF0000000)
+    assert lanes[0][1] == 3
+    assert lanes[1][1] == 1
+    assert lanes[3][15] == 2
+    assert lanes[4][1] == 0xA
+    assert lanes[4][15] == 0xF
+    assert sum(map(sum, lanes)) == 3 + 1 + 2 + 0xA + 0xF
+
+
+def test_keep_masks():
+    assert gpio_regs.keep_masks(0x8001) == (0xFFFF7FFE, 0x3FFFFFFC,
+                                            0x0FFFFFFFFFFFFFF0)
+
+
+def test_port_state():
+    # Words follow set_pin() and are re-encoded only after a change.
+    state = chip_stm.PortState('PA')
+    state.set_pin(1, True, 2, 1, 3, 1, 7)
+    state.set_pin(15, True, 1, 0, 0, 2, 0)
+    words = state.words()
+    assert words == (0x40000008, 0x0002, 0x0000000C, 0x80000004,
+                     0x00000070, 0x00000000)
+    assert state.words() is words
+    assert state.touched == 0x8002
+
+    state.set_pin(1, False, 2, 1, 3, 1, 7)
+    assert state.words() == (0x40000000, 0, 0, 0x80000000, 0, 0)
+    assert state.touched == 0x8000
@@ -0,0 +1,51 @@
+import os
+import stat
+
+import pytest
+
+from stm_layout import chip_db, chip_stm, output
+
+
+# A part with no REFM_TABLE entry, so no known GPIO register layout.
+NO_REFM_PART = 'stm32f407vgt6'
+
+
+@pytest.fixture(name='chip')
+def _chip():
+    chip = chip_stm.load_chip(NO_REFM_PART)
+    with pytest.raises(KeyError):
+        chip_db.get_refm(chip.part)
+    return chip
+
+
+def test_no_refm_ports_fall_back_to_chip_ports(chip):
+    assert chip.gpio_ports() == sorted(chip.ports)
+
+
+def test_no_refm_writer(chip, tmp_path):
+    path   = str(tmp_path / 'pinout.txt')
+    writer = output.PinoutWriter(chip, path)
+    assert not writer.dirty()
+
+    pin = next(p for p in chip.pins.values() if p.name == 'PB3')
+    pin._set_choice(1)
+    assert [s.name for s in output.configured_ports(chip)] == ['PB']
+    assert writer.write()
+    with open(path, encoding='utf8') as f:
+        text = f.read()
+    assert text == chip.serialize_settings()
+    assert text.startswith('PB.MODER')
+
+
+def test_atomic_write_mode(tmp_path):
+    path  = str(tmp_path / 'out.h')
+    umask = os.umask(0o022)
+    try:
+        output.atomic_write(path, lambda f: f.write('new\n'))
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+
+        os.chmod(path, 0o664)
+        output.atomic_write(path, lambda f: f.write('again\n'))
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o664
+    finally:
+        os.umask(umask)
@@ -0,0 +1,115 @@
+import pytest
+
+from stm_layout import chip_stm, pin_config
+
+
+PART = 'stm32g474cet6'
+
+
+@pytest.fixture(name='chip', scope='module')
+def _chip():
+    return chip_stm.load_chip(PART)
+
+
+def _kinds(problems):
+    return [(p.kind, p.pin) for p in problems]
+
+
+@pytest.mark.parametrize('value', ['AF7', 'af7', '7', 7])
+def test_parse_af(value):
+    assert pin_config._parse_af(value) == 7
+
+
+@pytest.mark.parametrize('value', [16, -1, 'AF16', 'AFx', [7], {'af': 7},
+                                   None, True, 7.0])
+def test_parse_af_rejects(value):
+    with pytest.raises(ValueError):
+        pin_config._parse_af(value)
+
+
+@pytest.mark.parametrize('value, i', [('Alternate', 2), ('analog', 3),
+                                      ('1', 1), (0, 0)])
+def test_parse_choice(value, i):
+    assert pin_config._parse_choice(chip_stm.MODE_CHOICES, value) == i
+
+
+@pytest.mark.parametrize('value', ['Output', 4, [1], None, False])
+def test_parse_choice_rejects(value):
+    with pytest.raises(ValueError):
+        pin_config._parse_choice(chip_stm.MODE_CHOICES, value)
+
+
+@pytest.mark.parametrize('name, text', [
+    ('bad.yaml', 'pins: {PA0: [\n'),
+    ('bad.json', '{"pins": '),
+    ('list.json', '[1, 2]'),
+    ('nopins.yaml', 'part: stm32g474cet6\n'),
+    ('nopin.csv', 'mode,speed\nAnalog,Low\n'),
+    ('bad.txt', 'PA0\n'),
+    ])
+def test_load_config_rejects(tmp_path, name, text):
+    if name.endswith('.yaml'):
+        pytest.importorskip('yaml')
+    path = tmp_path / name
+    path.write_text(text)
+    with pytest.raises(ValueError) as e:
+        pin_config.load_config(str(path))
+    assert str(e.value).startswith(str(path) + ': ')
+
+
+def test_load_config_csv(tmp_path):
+    path = tmp_path / 'pins.csv'
+    path.write_text('pin,mode,af\nPA9,,AF7\nPB0,Analog,\n')
+    assert pin_config.load_config(str(path)) == (
+        None, {'PA9' : {'af' : 'AF7'}, 'PB0' : {'mode' : 'Analog'}})
+
+
+def test_resolve_signal(chip):
+    settings, problems = pin_config.resolve(chip, {
+        'PA9'  : {'signal' : 'USART1_TX', 'speed' : 'High'},
+        'PA10' : {'af' : 'AF7', 'resistor' : 'Pull-Up'},
+        'PB0'  : {'mode' : 'Analog'},
+        })
+    assert not problems
+    assert [(s.name, s.choices, s.af) for s in settings] == [
+        ('PA9', (None, 2, None, None), 7),
+        ('PA10', (None, None, None, 1), 7),
+        ('PB0', (3, None, None, None), None),
+        ]
+
+
+def test_resolve_problems(chip):
+    _, problems = pin_config.resolve(chip, {
+        'PZ9' : {'mode' : 'Analog'},
+        'PA0' : {'mode' : [1], 'speed' : {'a' : 1}, 'signal' : ['X']},
+        'PA1' : {'af' : [3]},
+        'PA2' : ['Analog'],
+        'PA9' : {'signal' : 'USART1_TX', 'mode' : 'GPO'},
+        'PB6' : {'signal' : 'USART1_TX'},
+        'PB7' : {'af' : 0},
+        'PB8' : {'signal' : 'SPI1_SCK'},
+        })
+    assert _kinds(problems) == [
+        (pin_config.UNKNOWN_PIN, 'PZ9'),
+        (pin_config.BAD_VALUE, 'PA0'),
+        (pin_config.BAD_VALUE, 'PA0'),
+        (pin_config.BAD_VALUE, 'PA0'),
+        (pin_config.BAD_VALUE, 'PA1'),
+        (pin_config.BAD_VALUE, 'PA2'),
+        (pin_config.DISABLED_CHOICE, 'PA9'),
+        (pin_config.NO_FUNCTION, 'PB7'),
+        (pin_config.NO_FUNCTION, 'PB8'),
+        (pin_config.DUPLICATE_SIGNAL, None),
+        ]
+
+
+def test_apply_config(chip):
+    chip.reset()
+    assert not pin_config.apply_config(chip, {'PA9' : {'af' : 7}})
+    pa9 = pin_config.gpio_names(chip)['PA9'][0]
+    assert pa9._altfn == 7
+    assert pa9._choices[0].val == 2
+
+    chip.reset()
+    assert pin_config.apply_config(chip, {'PA9' : {'af' : 0}})
+    assert pa9._altfn is None
@@ -0,0 +1,42 @@
+import pytest
+
+from stm_layout import chip_stm, pin_diff
+
+
+PART = 'stm32g474cet6'
+
+
+@pytest.fixture(name='chips')
+def _chips():
+    return chip_stm.load_chip(PART), chip_stm.load_chip(PART)
+
+
+def _pin(chip, name):
+    return next(p for p in chip.pins.values() if p.name == name)
+
+
+def test_same_part(chips):
+    assert not pin_diff.diff_chips(*chips)
+
+
+def test_order_only(chips):
+    # Functions listed in another order are not a change.
+    a, b = chips
+    pin  = _pin(b, 'PA0')
+    assert len(pin.add_fns) > 1
+    pin.add_fns = tuple(reversed(pin.add_fns))
+    assert not pin_diff.diff_chips(a, b)
+
+
+def test_changed(chips):
+    a, b        = chips
+    pin         = _pin(b, 'PA9')
+    pin.alt_fns = pin.alt_fns[:7] + ('-',) + pin.alt_fns[8:]
+    pin.add_fns = pin.add_fns + ('ADC9_IN1',)
+    d,          = pin_diff.diff_chips(a, b)
+    assert d.key == pin.key
+    assert d.lost_alt_fns == [(7, 'USART1_TX')]
+    assert d.gained_add_fns == ['ADC9_IN1']
+    assert not d.gained_alt_fns and not d.lost_add_fns
+    assert pin_diff.format_delta(d).split()[-2:] == ['-AF7:USART1_TX',
+                                                     '+ADC9_IN1']
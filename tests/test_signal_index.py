@@ -0,0 +1,14 @@
+from stm_layout import signal_index
+
+
+def test_lookup():
+    hits = signal_index.lookup('USART1_TX', prefix='stm32g474cet6')
+    assert [(h.key, h.af) for h in hits] == [('31', 7), ('43', 7)]
+    assert {h.partname for h in hits} == {'stm32g474cet6'}
+
+
+def test_skipped():
+    # make_pins() can't parse stm32h503 pin names like PA13(JTMS-SWDIO).
+    skipped = signal_index.skipped_parts('stm32h503')
+    assert 'stm32h503cbt6' in skipped
+    assert not signal_index.lookup('USART1_TX', prefix='stm32h503')
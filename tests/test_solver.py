@@ -0,0 +1,118 @@
+import pytest
+
+from stm_layout import chip_stm, solver
+
+
+PART = 'stm32g474cet6'
+
+
+@pytest.fixture(name='chip', scope='module')
+def _chip():
+    return chip_stm.load_chip(PART)
+
+
+def test_hopcroft_karp():
+    # a and b both want 1, so a perfect matching must route a through 2 and
+    # c through 3; d has nowhere to go once the others are placed.
+    adj = {'a' : [1, 2], 'b' : [1], 'c' : [2, 3], 'd' : [3]}
+    m   = solver.hopcroft_karp(['a', 'b', 'c'], adj)
+    assert m == {'a' : 2, 'b' : 1, 'c' : 3}
+
+    m = solver.hopcroft_karp(['a', 'b', 'c', 'd'], adj)
+    assert len(m) == 3
+    assert len(set(m.values())) == 3
+
+    # Extending a matching doesn't modify the one passed in.
+    start = {'a' : 1}
+    m     = solver.hopcroft_karp(['a', 'b'], adj, start)
+    assert m == {'a' : 2, 'b' : 1}
+    assert start == {'a' : 1}
+
+
+def test_min_cost_matching():
+    # Greedy would give a its cheapest pin 1 and then b would have to take
+    # the expensive 3; the optimum moves a to 2.
+    adj  = {'a' : [1, 2], 'b' : [1, 3]}
+    cost = {1 : 0, 2 : 1, 3 : 10}
+    m    = solver.min_cost_matching(['a', 'b'], adj, cost)
+    assert m == {'a' : 2, 'b' : 1}
+    adj['c'] = [1]
+    adj['d'] = [1]
+    assert solver.min_cost_matching(['a', 'b', 'c', 'd'], adj,
+                                    cost) is None
+
+
+def test_parse_request(chip):
+    signal_pins = chip.signal_pins()
+    g, = solver.parse_request('USART1_TX', signal_pins)
+    assert g.instances == ['USART1'] and g.roles == ('TX',)
+    g, = solver.parse_request('SPI2', signal_pins)
+    assert g.roles == ('SCK', 'MISO', 'MOSI')
+    groups = solver.parse_request('2*USART', signal_pins)
+    assert len(groups) == 2 and groups[0] is groups[1]
+    assert groups[0].instances == ['USART1', 'USART2', 'USART3']
+    with pytest.raises(ValueError):
+        solver.parse_request('USART9', signal_pins)
+    with pytest.raises(ValueError):
+        solver.parse_request('TIM3', signal_pins)
+
+
+def test_feasible(chip):
+    s = solver.solve(chip, ['USART1'])
+    assert s.assignment == {'USART1_TX' : ('PA9', 7),
+                            'USART1_RX' : ('PA10', 7)}
+    assert s.optimal
+
+    s = solver.solve(chip, ['3*USART'])
+    assert sorted(i for _, i in s.instances) == ['USART1', 'USART2',
+                                                 'USART3']
+    pins = [p for p, _ in s.assignment.values()]
+    assert len(pins) == len(set(pins)) == 6
+
+
+def test_infeasible(chip):
+    # Only three USARTs, and USART1_TX can only go on PA9 or PB6.
+    assert solver.solve(chip, ['4*USART']) is None
+    assert solver.solve(chip, ['USART1_TX'],
+                        fixed={'PA9' : None, 'PB6' : None}) is None
+    with pytest.raises(ValueError):
+        solver.solve(chip, ['USART1'], fixed={'PA0' : 'USART1_TX'})
+
+
+def test_fixed(chip):
+    s = solver.solve(chip, ['USART1'], fixed={'PB6' : 'USART1_TX'})
+    assert s.assignment['USART1_TX'] == ('PB6', 7)
+    assert s.assignment['USART1_RX'][0] != 'PB6'
+
+
+def test_score(chip):
+    score = {p.name: 0 for p in chip.pins.values() if p._choices}
+    score['PA9'] = 5
+    s = solver.solve(chip, ['USART1'], score=score)
+    assert s.assignment['USART1_TX'] == ('PB6', 7)
+    assert s.cost == 0
+    assert s.optimal
+
+
+def test_timeout(chip):
+    with pytest.raises(solver.Timeout):
+        solver.solve(chip, ['USART1'], budget=-1)
+
+
+def test_timeout_keeps_best(chip, monkeypatch):
+    # USART1 is tried first but is the expensive choice; running out of
+    # time right after finding it returns it, not claimed to be optimal.
+    record = solver.Solver._record
+
+    def _record(self, *args):
+        record(self, *args)
+        self.deadline = float('-inf')
+
+    monkeypatch.setattr(solver.Solver, '_record', _record)
+    score = {p.name: 0 for p in chip.pins.values() if p._choices}
+    for p in ('PA9', 'PA10', 'PB6', 'PB7'):
+        score[p] = 5
+    s = solver.solve(chip, ['USART'], score=score)
+    assert s.instances == [('USART', 'USART1')]
+    assert s.cost == 10
+    assert not s.optimal
@@ -0,0 +1,53 @@
+import pytest
+
+from stm_layout import sweep
+
+
+PREFIX = 'stm32g471'
+
+
+@pytest.fixture(name='candidates', scope='module')
+def _candidates():
+    # UART4 isn't bonded out on the 48-pin LQFPs, and the UFBGA100 parts
+    # don't load (their ball map names a ball the package doesn't have).
+    return sweep.sweep(PREFIX, ['UART4'])
+
+
+def test_sweep_ranking(candidates):
+    ok = [c for c in candidates if c.cost is not None]
+    assert ok
+    assert candidates[:len(ok)] == ok
+    assert ok == sorted(ok, key=lambda c: (c.pin_count, c.flash,
+                                           c.partname))
+
+
+def test_sweep_rejected(candidates):
+    rejected = [c for c in candidates if c.note == sweep.REJECTED]
+    assert rejected
+    assert {c.package for c in rejected} == {'LQFP48'}
+    assert all(c.cost is None for c in rejected)
+
+
+def test_sweep_load_errors(candidates):
+    failed = [c for c in candidates if sweep.load_failed(c)]
+    assert failed
+    assert {c.package for c in failed} == {'UFBGA100'}
+    assert all(c.cost is None and 'KeyError' in c.note for c in failed)
+    assert candidates[-len(failed):] == failed
+
+
+def test_sweep_infeasible():
+    candidates = sweep.sweep(PREFIX + 'cc', ['USART1_TX'],
+                             side='left', budget=1.)
+    assert all(c.cost is not None and c.optimal for c in candidates)
+
+    candidates = sweep.sweep(PREFIX + 'cc', ['4*USART'])
+    assert candidates
+    assert all(c.note == sweep.INFEASIBLE for c in candidates)
+
+
+def test_sweep_unindexed():
+    # Parts missing from the signal index are load errors, not rejected.
+    candidates = sweep.sweep('stm32h503', ['USART1'])
+    assert candidates
+    assert all(sweep.load_failed(c) for c in candidates)